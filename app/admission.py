@@ -0,0 +1,83 @@
+""" Admission control and per client rate limiting """
+
+import math
+import time
+import threading
+
+
+class ConcurrencyLimiter:
+    """ Bounded number of requests in flight per route class """
+
+    def __init__(self, limits, timeout):
+        # One semaphore per route class, a limit of None leaves the class unbounded
+        self.semaphores = {
+            route_class: threading.BoundedSemaphore(limit)
+            for route_class, limit in limits.items() if limit is not None}
+        # Seconds to wait for a slot before shedding the request
+        self.timeout = timeout
+        # Counters for monitoring
+        self.stats = {'admitted': 0, 'rejected': 0}
+
+    def acquire(self, route_class):
+        """ Take a slot for route_class, False if none became free within timeout """
+        semaphore = self.semaphores.get(route_class)
+        if semaphore is None:
+            return True
+        if self.timeout:
+            admitted = semaphore.acquire(timeout=self.timeout)
+        else:
+            admitted = semaphore.acquire(blocking=False)
+        self.stats['admitted' if admitted else 'rejected'] += 1
+        return admitted
+
+    def release(self, route_class):
+        """ Give back a slot taken with acquire """
+        semaphore = self.semaphores.get(route_class)
+        if semaphore is not None:
+            semaphore.release()
+
+
+class TokenBucketLimiter:
+    """ Token bucket per client, refilled at rate tokens per second up to burst """
+
+    def __init__(self, rate, burst, max_clients):
+        # Sustained requests per second allowed per client
+        self.rate = rate
+        # Requests a client may make at once after being idle
+        self.burst = burst
+        # Buckets kept before idle ones are dropped
+        self.max_clients = max_clients
+        # Client key: (tokens, last refill time)
+        self.buckets = {}
+        self.lock = threading.Lock()
+        # Counters for monitoring
+        self.stats = {'allowed': 0, 'limited': 0}
+
+    def take(self, key):
+        """ Take a token for key, returns seconds to wait before retrying or 0 if allowed """
+        now = time.time()
+        with self.lock:
+            tokens, last = self.buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens < 1:
+                self.buckets[key] = (tokens, now)
+                self.stats['limited'] += 1
+                return (1 - tokens) / self.rate
+            if key not in self.buckets and len(self.buckets) >= self.max_clients:
+                self.prune(now)
+            self.buckets[key] = (tokens - 1, now)
+            self.stats['allowed'] += 1
+            return 0
+
+    def prune(self, now):
+        """ Drop buckets that have refilled completely, they behave like new clients """
+        full = [key for key, (tokens, last) in self.buckets.items()
+                if tokens + (now - last) * self.rate >= self.burst]
+        for key in full:
+            del self.buckets[key]
+
+
+# Seconds to put in a Retry-After header
+def retry_after(seconds):
+    """ Whole seconds, at least one """
+    return str(max(1, int(math.ceil(seconds))))
@@ -1,13 +1,27 @@
 """ This is where the main work of routing is carried out """
 
-from flask import jsonify
+from queue import Full
+from flask import jsonify, g
 from app.dao import DAO
 from app.utils import Utils
+from app.write_queue import WriteBehindQueue
+from app.warmup import CacheWarmer
+from app.cache import ResponseCache
+from app.similarity import SimilarityIndex
+from app.single_flight import SingleFlight
+from app.admission import ConcurrencyLimiter, TokenBucketLimiter, retry_after
+from app.compression import choose_encoding, compress, compress_response, set_encoded_body
 from app.constants import USER_ACCESSING_MOVIE_LIST, USER_ACCESSED_MOVIE_LIST, \
     USER_ADDING_TO_MOVIE_LIST, USER_ADDED_TO_MOVIE_LIST, USER_UPDATING_MOVIE_IN_LIST, \
     USER_UPDATED_MOVIE_IN_LIST, USER_ACCESSING_MOVIE_BY_ID, USER_ACCESSED_MOVIE_BY_ID, \
     MOVIE_LIST_MIN, MOVIE_LIST_MAX, MOVIE_LIST_DEFAULT, MOVIE_ALREADY_EXISTS, \
-    MOVIE_LIST_LIMIT_ERROR, MOVIE_LIST_RATING_ERROR, MOVIE_DOES_NOT_EXIST
+    MOVIE_LIST_LIMIT_ERROR, MOVIE_LIST_RATING_ERROR, MOVIE_DOES_NOT_EXIST, WRITE_QUEUE_FULL, \
+    WRITE_QUEUE_RETRY_AFTER, USER_QUEUED_RATING, USER_ACCESSING_MOVIES_BY_IDS, \
+    USER_ACCESSED_MOVIES_BY_IDS, MOVIE_ID_DOES_NOT_EXIST, MOVIE_BATCH_MAX, MOVIE_BATCH_IDS_ERROR, \
+    BATCH_SCHEMA, OMDB_RATINGS, MOVIE_FIELDS, MOVIE_FIELDS_ERROR, ADMISSION_REJECTED, \
+    ADMISSION_RETRY_AFTER, RATE_LIMITED, ADMISSION_SHED, CLIENT_RATE_LIMITED, \
+    ENRICHED_ENDPOINTS, USER_ACCESSED_DISTRIBUTION, SIMILARITY_INDEX_MISSING, SIMILAR_LIMIT_ERROR, \
+    USER_ACCESSED_SIMILAR
 
 
 class AppObject:
@@ -17,12 +31,108 @@ class AppObject:
         self.app = app
         self.dao = DAO.dao_factory(app)
         self.utils = Utils(self.app.config, self.app.logger)
+        # Serialized list responses
+        self.response_cache = ResponseCache(
+            self.app.config['RESPONSE_CACHE_MAX_BYTES'], self.app.config['RESPONSE_CACHE_TTL'])
+        # Optional write-behind queue for rating writes
+        self.write_queue = None
+        if self.app.config['WRITE_BEHIND']:
+            self.write_queue = WriteBehindQueue(self.dao, self.app.config, self.app.logger)
+        # Concurrent lookups of the same movie by id share one query
+        self.movie_flight = SingleFlight()
+        # Similar movies index, mapped on first use and remapped when rebuilt
+        self.similarity = SimilarityIndex(self.app.config['SIMILARITY_INDEX'])
+        # Requests in flight per route class
+        self.admission = ConcurrencyLimiter(
+            self.app.config['ADMISSION_LIMITS'], self.app.config['ADMISSION_TIMEOUT'])
+        # Optional per client rate limiting
+        self.rate_limiter = None
+        if self.app.config['RATE_LIMIT_PER_SECOND']:
+            self.rate_limiter = TokenBucketLimiter(
+                self.app.config['RATE_LIMIT_PER_SECOND'], self.app.config['RATE_LIMIT_BURST'],
+                self.app.config['RATE_LIMIT_MAX_CLIENTS'])
+
+    # Warm third party ratings cache in the background
+    def start_warmup(self):
+        """ Start warming the third party ratings cache """
+        warmer = CacheWarmer(
+            self.dao, lambda movie: self.utils.get_third_party_ratings(movie['title']),
+            self.app.config, self.app.logger,
+            is_warm=lambda movie: movie['title'].lower() in self.utils.ratings_cache)
+        warmer.start()
+        return warmer
+
+    # Called before each request
+    def before_request(self, request):
+        """ Reset per request query counters and admit or shed the request """
+        self.dao.query_stats.start_request()
+
+        # Rate limit per client, keyed on the same identity get_user uses
+        if self.rate_limiter is not None:
+            wait = self.rate_limiter.take(request.remote_addr)
+            if wait:
+                self.app.logger.debug(CLIENT_RATE_LIMITED, request.remote_addr, wait)
+                return self.reject(RATE_LIMITED, wait, 429)
+
+        # Bound requests in flight per route class, shedding the excess early
+        route_class = self.route_class(request)
+        if not self.admission.acquire(route_class):
+            self.app.logger.debug(ADMISSION_SHED, route_class, request.remote_addr)
+            return self.reject(ADMISSION_REJECTED, ADMISSION_RETRY_AFTER, 503)
+        # Remember the slot so teardown_request gives it back
+        g.route_class = route_class
+        return None
+
+    # Called when each request is torn down, even if it raised
+    def teardown_request(self):
+        """ Release the route class slot taken in before_request """
+        route_class = g.pop('route_class', None)
+        if route_class is not None:
+            self.admission.release(route_class)
+
+    # Classify a request for admission control
+    def route_class(self, request):
+        """ 'write' for rating writes, 'enrichment' for reads that call OMDB, else 'read' """
+        if request.method in ('POST', 'PUT') and request.endpoint != 'batch_movies':
+            return 'write'
+        if request.endpoint not in ENRICHED_ENDPOINTS:
+            return 'read'
+        try:
+            enrich = self.parse_projection(request)[2]
+        except ValueError:
+            # The route returns a 400 without calling OMDB
+            enrich = False
+        return 'enrichment' if enrich else 'read'
+
+    # Error response asking the client to back off
+    def reject(self, message, wait, status):
+        """ Error response with a Retry-After header """
+        response = self.utils.convert_error(message)
+        response.headers['Retry-After'] = retry_after(wait)
+        return response, status
+
+    # Called after each request
+    def after_request(self, request, response):
+        """ Check per request query counters and compress the response """
+        self.dao.query_stats.end_request(request.path)
+        # Compress responses that were not already compressed from the cache
+        return compress_response(response, request.headers.get('Accept-Encoding'), self.app.config)
 
     # Get movies
     def list_movies(self, request):
         """ Get movie list """
         # User is attempting to access movie list
 
+        # Batch fetch of movies by id, e.g. ?ids=1,2,3
+        ids = request.args.get("ids")
+        if ids is not None:
+            try:
+                ids = [int(id_) for id_ in ids.split(',')]
+            except ValueError:
+                return self.utils.convert_error(
+                    MOVIE_BATCH_IDS_ERROR.format(MOVIE_BATCH_MAX)), 400
+            return self.get_movies_by_ids(request, ids)
+
         # Check user limit in request query falls within min/max limits
         limit = request.args.get("limit")
         if limit:
@@ -32,19 +142,56 @@ class AppObject:
         else:
             limit = MOVIE_LIST_DEFAULT
 
-        # Log user accessing movie list
-        self.app.logger.debug(USER_ACCESSING_MOVIE_LIST.format(request.remote_addr))
+        # Fields to return and whether third party ratings are needed
+        try:
+            columns, fields, enrich = self.parse_projection(request)
+        except ValueError as error:
+            return self.utils.convert_error(str(error)), 400
 
-        # Get movie list via self.dao
-        movie_list = self.dao.get_all_movies(limit=int(limit))
-        # Access 3rd pary movie ratings
-        for movie in movie_list:
-            movie.update(self.utils.get_third_party_ratings(movie['title']))
+        # Log user accessing movie list
+        self.app.logger.debug(USER_ACCESSING_MOVIE_LIST, request.remote_addr)
+
+        # Serve the cached body if nothing has been written since it was built, the version
+        # is read before querying so a concurrent write can only make the entry unreachable
+        cache_key = ('movies', int(limit), fields, enrich, self.dao.data_version)
+        body = self.response_cache.get(cache_key)
+        if body is not None:
+            return self.cached_response(request, cache_key, body), 200
+
+        # Get movie list via self.dao, loading only the columns needed
+        movie_list = self.dao.get_all_movies(limit=int(limit), fields=columns)
+        # Access 3rd pary movie ratings unless the caller does not need them
+        if enrich:
+            for movie in movie_list:
+                movie.update(self.utils.get_third_party_ratings(movie['title']))
+        movie_list = project(movie_list, fields)
 
         # Log user has successfully accessed movie list
-        self.app.logger.debug(USER_ACCESSED_MOVIE_LIST.format(request.remote_addr))
-        # Return jsonified movie list with success code
-        return jsonify({'Movies': movie_list}), 200
+        self.app.logger.debug(USER_ACCESSED_MOVIE_LIST, request.remote_addr)
+        # Return jsonified movie list with success code, keeping the body for later requests
+        body = jsonify({'Movies': movie_list}).get_data()
+        self.response_cache.set(cache_key, body)
+        return self.cached_response(request, cache_key, body), 200
+
+    # Build a response from a cached body
+    def cached_response(self, request, cache_key, body):
+        """ Response for body, compressed once per encoding and cached next to the raw body """
+        response = self.app.response_class(body, mimetype='application/json')
+        response.vary.add('Accept-Encoding')
+        # Small bodies are not worth compressing
+        if len(body) < self.app.config['COMPRESS_MIN_SIZE']:
+            return response
+        encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+        if encoding is None:
+            return response
+
+        encoded_key = cache_key + (encoding,)
+        encoded = self.response_cache.get(encoded_key)
+        if encoded is None:
+            encoded = compress(body, encoding, self.app.config)
+            self.response_cache.set(encoded_key, encoded)
+        set_encoded_body(response, encoded, encoding)
+        return response
 
     # Add movie to list
     def add_movie(self, request):
@@ -65,7 +212,7 @@ class AppObject:
             return self.utils.convert_error(MOVIE_LIST_RATING_ERROR), 400
 
         # Log user is attempting to add movie to list
-        self.app.logger.debug(USER_ADDING_TO_MOVIE_LIST.format(clientip, title, rating))
+        self.app.logger.debug(USER_ADDING_TO_MOVIE_LIST, clientip, title, rating)
 
         # Get user information
         user = self.dao.get_user(clientip=clientip)
@@ -73,16 +220,19 @@ class AppObject:
         # Check if movie exists
         movie_exists = self.dao.get_movie_by_title(title=title)
 
+        # If the user has a rating for this movie (should be a PUT), return error
+        if movie_exists and \
+                self.dao.get_user_rating(user_id=user['id'], movie_id=movie_exists['id']):
+            return MOVIE_ALREADY_EXISTS, 400
+
+        # In write-behind mode acknowledge once the write is queued
+        if self.write_queue:
+            return self.queue_rating_write('POST', clientip, title, rating, user['id'])
+
         # If the movie is already there
         if movie_exists:
-
-            # If the user has a rating for this movie (should be a PUT), return error
-            if self.dao.get_user_rating(user_id=user['id'], movie_id=movie_exists['id']):
-                return MOVIE_ALREADY_EXISTS, 400
-            # If the user does not have rating add rating
-            else:
-                # Method will update movie rating and user rating
-                update_movie_rating(rating, user['id'], movie_exists['id'])
+            # Method will update movie rating and user rating
+            self.update_movie_rating(rating, user['id'], movie_exists['id'])
         else:
             # Add movie with rating
             movie = self.dao.add_movie(title=title, rating=rating)
@@ -94,9 +244,7 @@ class AppObject:
                 movie_id=movie['id'])
 
         # Log user successfully added movie to list
-        message = USER_ADDED_TO_MOVIE_LIST.format(request.remote_addr, title, rating)
-        self.app.logger.debug(message)
-        self.app.logger.info(message)
+        self.app.logger.info(USER_ADDED_TO_MOVIE_LIST, request.remote_addr, title, rating)
         # Return success code
         return 'Make a new movie', 200
 
@@ -119,7 +267,7 @@ class AppObject:
             return self.utils.convert_error(MOVIE_LIST_RATING_ERROR), 400
 
         # Log user is attempting to update movie in list
-        self.app.logger.debug(USER_UPDATING_MOVIE_IN_LIST.format(clientip, title, rating))
+        self.app.logger.debug(USER_UPDATING_MOVIE_IN_LIST, clientip, title, rating)
 
         # Get user information
         user = self.dao.get_user(clientip=clientip)
@@ -132,13 +280,15 @@ class AppObject:
             # Convert error to return to client
             return MOVIE_DOES_NOT_EXIST, 400
 
+        # In write-behind mode acknowledge once the write is queued
+        if self.write_queue:
+            return self.queue_rating_write('PUT', clientip, title, rating, user['id'])
+
         # Method will update movie rating and user rating
         self.update_movie_rating(rating, user['id'], movie_exists['id'])
 
         # Log user has successfully updated movie in list
-        message = USER_UPDATED_MOVIE_IN_LIST.format(clientip, title, rating)
-        self.app.logger.debug(message)
-        self.app.logger.info(message)
+        self.app.logger.info(USER_UPDATED_MOVIE_IN_LIST, clientip, title, rating)
         return 'Updates the movie', 200
 
     # Get movie by id
@@ -146,22 +296,166 @@ class AppObject:
         """ Get Movie by Id """
         request_ip = request.remote_addr
 
+        # Fields to return and whether third party ratings are needed
+        try:
+            columns, fields, enrich = self.parse_projection(request)
+        except ValueError as error:
+            return self.utils.convert_error(str(error)), 400
+
         # Log is attempting to get movie by ID
-        self.app.logger.debug(USER_ACCESSING_MOVIE_BY_ID.format(request_ip, movie_id))
+        self.app.logger.debug(USER_ACCESSING_MOVIE_BY_ID, request_ip, movie_id)
 
-        # Get movie by id via self.dao
-        movie = self.dao.get_movie_by_id(id_=movie_id)
+        # Get movie by id via self.dao, loading only the columns needed, once for all
+        # concurrent requests for the same movie and columns
+        movie = self.movie_flight.do(
+            (movie_id, tuple(columns) if columns else None),
+            lambda: self.dao.get_movie_by_id(id_=movie_id, fields=columns))
         if not movie:
-            error = 'Movie does not exist with id {}!'.format(movie_id)
+            error = MOVIE_ID_DOES_NOT_EXIST.format(movie_id)
             return self.utils.convert_error(error), 400
+        # Coalesced requests share the result, copy it before adding ratings
+        movie = dict(movie)
 
-        movie.update(self.utils.get_third_party_ratings(movie['title']))
+        if enrich:
+            movie.update(self.utils.get_third_party_ratings(movie['title']))
         # Log user successfully accessed movie by ID
-        message = USER_ACCESSED_MOVIE_BY_ID.format(request_ip, movie['title'], movie_id)
-        self.app.logger.debug(message)
-        self.app.logger.info(message)
+        self.app.logger.info(USER_ACCESSED_MOVIE_BY_ID, request_ip, movie.get('title'), movie_id)
         # Return jsonified movie list with success code
-        return jsonify(movie), 200
+        return jsonify(project([movie], fields)[0]), 200
+
+    # Get movie rating distribution
+    def get_rating_distribution(self, request, movie_id):
+        """ Get the number of ratings in each whole star bucket of a movie """
+        # Maintained on every rating write, so this is a single primary key lookup
+        distribution = self.dao.get_rating_distribution(movie_id=movie_id)
+        if distribution is None:
+            error = MOVIE_ID_DOES_NOT_EXIST.format(movie_id)
+            return self.utils.convert_error(error), 400
+
+        # Log user accessed movie rating distribution
+        self.app.logger.debug(USER_ACCESSED_DISTRIBUTION, request.remote_addr, movie_id)
+        return jsonify({'id': movie_id, 'count': sum(distribution.values()),
+                        'distribution': distribution}), 200
+
+    # Get similar movies
+    def get_similar_movies(self, request, movie_id):
+        """ Get the movies most similar to a movie, from the precomputed index """
+        # Number of neighbors to return, at most the number stored per movie
+        top_k = self.app.config['SIMILARITY_TOP_K']
+        limit = request.args.get('limit', str(top_k))
+        if not limit.isdigit() or int(limit) < 1 or int(limit) > top_k:
+            return self.utils.convert_error(SIMILAR_LIMIT_ERROR.format(top_k)), 400
+
+        # O(limit) read of the movie's row in the memory-mapped index
+        neighbors = self.similarity.neighbors(movie_id, int(limit))
+        if neighbors is None:
+            return self.utils.convert_error(SIMILARITY_INDEX_MISSING), 503
+
+        # Movie and its neighbors in a single IN query, neighbors deleted since the build are
+        # left out
+        scores = dict(neighbors)
+        movies = {movie['id']: movie for movie in self.dao.get_movies_by_ids(
+            ids=[movie_id] + list(scores), fields=MOVIE_FIELDS)}
+        if movie_id not in movies:
+            error = MOVIE_ID_DOES_NOT_EXIST.format(movie_id)
+            return self.utils.convert_error(error), 400
+        similar = [dict(movies[id_], score=score) for id_, score in neighbors if id_ in movies]
+
+        # Log user accessed similar movies
+        self.app.logger.debug(USER_ACCESSED_SIMILAR, request.remote_addr, len(similar), movie_id)
+        return jsonify({'id': movie_id, 'Movies': similar}), 200
+
+    # Parse ?fields= and ?external=
+    def parse_projection(self, request):
+        """ Columns to load, fields to return (None for all) and whether to enrich """
+        # ?external=false skips third party ratings altogether
+        enrich = request.args.get('external', 'true').lower() != 'false'
+        fields = request.args.get('fields')
+        if fields is None:
+            return None, None, enrich
+
+        fields = tuple(field.strip() for field in fields.split(',') if field.strip())
+        external_fields = set(OMDB_RATINGS.values())
+        # Only movie columns and third party rating names can be requested
+        if not fields or any(field not in MOVIE_FIELDS and field not in external_fields
+                             for field in fields):
+            raise ValueError(MOVIE_FIELDS_ERROR.format(
+                ', '.join(MOVIE_FIELDS + sorted(external_fields))))
+
+        # Only look up third party ratings if one of them was asked for
+        enrich = enrich and any(field in external_fields for field in fields)
+        # id is always loaded to order and match results, title if needed for the lookup
+        columns = [field for field in MOVIE_FIELDS
+                   if field in fields or field == 'id' or (field == 'title' and enrich)]
+        return columns, fields, enrich
+
+    # Get many movies by id, POST variant for long lists
+    def batch_movies(self, request):
+        """ Get movies by the ids in the posted json """
+        data = request.json
+        # Validate json against permitted schema
+        validation_error = self.utils.validate_json(data, BATCH_SCHEMA)
+        if validation_error:
+            return jsonify(validation_error), 400
+        return self.get_movies_by_ids(request, data['ids'])
+
+    # Get many movies by id
+    def get_movies_by_ids(self, request, ids):
+        """ Get movies by id in the requested order, with not found entries """
+        request_ip = request.remote_addr
+        # Check number of ids falls within limits
+        if not ids or len(ids) > MOVIE_BATCH_MAX:
+            return self.utils.convert_error(MOVIE_BATCH_IDS_ERROR.format(MOVIE_BATCH_MAX)), 400
+
+        # Fields to return and whether third party ratings are needed
+        try:
+            columns, fields, enrich = self.parse_projection(request)
+        except ValueError as error:
+            return self.utils.convert_error(str(error)), 400
+
+        # Log user is attempting to get movies by ids
+        self.app.logger.debug(USER_ACCESSING_MOVIES_BY_IDS, request_ip, len(ids))
+
+        # Get every requested movie with one query via self.dao
+        found = {movie['id']: movie
+                 for movie in self.dao.get_movies_by_ids(ids=ids, fields=columns)}
+        # Access 3rd party movie ratings in one batched step
+        ratings = {}
+        if enrich:
+            ratings = self.utils.get_third_party_ratings_batch(
+                [movie['title'] for movie in found.values()])
+
+        # Return movies in the requested order, explicitly marking missing ones
+        movie_list = []
+        for id_ in ids:
+            movie = found.get(id_)
+            if movie:
+                movie = project([dict(movie, **ratings.get(movie.get('title'), {}))], fields)[0]
+            else:
+                movie = {'id': id_, 'errors': [
+                    {'status': '404', 'detail': MOVIE_ID_DOES_NOT_EXIST.format(id_)}]}
+            movie_list.append(movie)
+
+        # Log user successfully accessed movies by ids
+        self.app.logger.debug(USER_ACCESSED_MOVIES_BY_IDS, request_ip, len(found), len(ids))
+        # Return jsonified movie list with success code
+        return jsonify({'Movies': movie_list}), 200
+
+    # Queue a rating write for the write-behind writer
+    def queue_rating_write(self, method, clientip, title, rating, user_id):
+        """ Queue rating write, 202 once queued or 503 if the queue is full """
+        try:
+            self.write_queue.put(
+                {'method': method, 'title': title, 'rating': rating, 'user_id': user_id})
+        except Full:
+            # Backpressure, ask the client to retry
+            response = self.utils.convert_error(WRITE_QUEUE_FULL)
+            response.headers['Retry-After'] = str(WRITE_QUEUE_RETRY_AFTER)
+            return response, 503
+
+        # Log user rating has been queued
+        self.app.logger.debug(USER_QUEUED_RATING, clientip, title, rating)
+        return 'Rating queued', 202
 
     # Update the movie rating
     def update_movie_rating(self, rating, user_id, movie_id):
@@ -177,3 +471,11 @@ class AppObject:
 
         # Update movie rating
         self.dao.update_movie(id_=movie_id, rating=rating)
+
+
+# Keep only the requested fields
+def project(movies, fields):
+    """ Movies with only the requested fields, or unchanged if fields is None """
+    if fields is None:
+        return movies
+    return [{field: movie[field] for field in fields if field in movie} for movie in movies]
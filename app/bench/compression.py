@@ -0,0 +1,80 @@
+""" Measure bandwidth and CPU per request of response compression by page size """
+
+import os
+import json
+import time
+import argparse
+from statistics import median
+from flask import Flask, jsonify
+from app.config import Config
+from app.compression import SUPPORTED_ENCODINGS, compress
+from app.bench.fake_omdb import movie_payload
+from app.constants import OMDB_RATINGS, BENCH_MOVIE_TITLE
+
+
+# Build a GET /movies body with page_size movies
+def list_body(app, page_size):
+    """ Serialized list response like list_movies returns """
+    movies = []
+    for movie_id in range(page_size, 0, -1):
+        title = BENCH_MOVIE_TITLE.format(movie_id)
+        movie = {'id': movie_id, 'title': title, 'rating': float(movie_id % 5 + 1)}
+        # Third party ratings as enrichment would add them
+        for rating in movie_payload(title)['Ratings']:
+            if rating['Source'] in OMDB_RATINGS:
+                movie[OMDB_RATINGS[rating['Source']]] = rating['Value'].split('/')[0]
+        movies.append(movie)
+    with app.app_context():
+        return jsonify({'Movies': movies}).get_data()
+
+
+# Time compressing body
+def measure(body, encoding, config, repeat):
+    """ Compressed size and median compress time in ms """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        compressed = compress(body, encoding, config)
+        timings.append((time.perf_counter() - start) * 1000)
+    return len(compressed), median(timings)
+
+
+def main():
+    """ Compressed size and compression CPU time per request for each page size """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--page-sizes', default='11,100,1000,10000',
+                        help='comma separated movies per response')
+    parser.add_argument('--repeat', type=int, default=20, help='compressions timed per case')
+    parser.add_argument('--output', default='bench_results', help='directory for JSON results')
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    results = []
+    print('{:>6} {:>10} {:>6} {:>10} {:>7} {:>12}'.format(
+        'movies', 'raw bytes', 'enc', 'enc bytes', 'ratio', 'compress ms'))
+    for page_size in [int(size) for size in args.page_sizes.split(',')]:
+        body = list_body(app, page_size)
+        for encoding in SUPPORTED_ENCODINGS:
+            size, compress_ms = measure(body, encoding, app.config, args.repeat)
+            result = {'movies': page_size, 'raw_bytes': len(body), 'encoding': encoding,
+                      'encoded_bytes': size, 'ratio': size / float(len(body)),
+                      'compress_ms': compress_ms,
+                      'below_threshold': len(body) < app.config['COMPRESS_MIN_SIZE']}
+            results.append(result)
+            print('{movies:>6} {raw_bytes:>10} {encoding:>6} {encoded_bytes:>10} '
+                  '{ratio:>7.2f} {compress_ms:>12.3f}'.format(**result))
+    print('Cached responses pay the compress time once, later hits only send encoded bytes')
+
+    # Save results so runs can be compared over time
+    os.makedirs(args.output, exist_ok=True)
+    output = os.path.join(
+        args.output, 'compression-{}.json'.format(time.strftime('%Y%m%d-%H%M%S')))
+    with open(output, 'w') as output_file:
+        json.dump({'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': results},
+                  output_file, indent=2, sort_keys=True)
+    print('Results saved to {}'.format(output))
+
+
+if __name__ == '__main__':
+    main()
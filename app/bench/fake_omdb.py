@@ -0,0 +1,230 @@
+""" Local OMDB stand-in with configurable latency and failures """
+
+import json
+import math
+import time
+import random
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+
+# OMDB error payloads
+OMDB_NOT_FOUND = {'Response': 'False', 'Error': 'Movie not found!'}
+OMDB_RATE_LIMITED = {'Response': 'False', 'Error': 'Request limit reached!'}
+OMDB_NO_TITLE = {'Response': 'False', 'Error': 'Incorrect IMDb ID.'}
+# Supported latency distributions
+LATENCY_DISTRIBUTIONS = ['fixed', 'uniform', 'exponential', 'lognormal']
+
+
+# Deterministic OMDB payload for a title
+def movie_payload(title):
+    """ OMDB style payload whose ratings depend only on the title """
+    digest = hashlib.md5(title.lower().encode('utf-8')).digest()
+    imdb = 1 + digest[0] % 90 / 10.0
+    metacritic = 1 + digest[1] % 100
+    tomatoes = digest[2] % 101
+    return {
+        'Title': title,
+        'Year': str(1950 + digest[3] % 70),
+        'Ratings': [
+            {'Source': 'Internet Movie Database', 'Value': '{:.1f}/10'.format(imdb)},
+            {'Source': 'Rotten Tomatoes', 'Value': '{}%'.format(tomatoes)},
+            {'Source': 'Metacritic', 'Value': '{}/100'.format(metacritic)},
+        ],
+        'Metascore': str(metacritic),
+        'imdbRating': '{:.1f}'.format(imdb),
+        'Response': 'True',
+    }
+
+
+class FakeOMDB:
+    """ Behaviour of the fake service, shared by all request threads """
+
+    # pylint: disable=too-many-instance-attributes,too-many-arguments
+    def __init__(self, latency='fixed', latency_ms=0.0, latency_sigma=0.5, error_rate=0.0,
+                 timeout_rate=0.0, timeout_seconds=30.0, not_found_rate=0.0,
+                 rate_limit=None, seed=0):
+        # Latency distribution and its parameters, latency_ms is the mean
+        self.latency = latency
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+        # Fraction of requests answered with a 500
+        self.error_rate = error_rate
+        # Fraction of requests held for timeout_seconds before answering
+        self.timeout_rate = timeout_rate
+        self.timeout_seconds = timeout_seconds
+        # Fraction of requests answered with movie not found
+        self.not_found_rate = not_found_rate
+        # Requests per second before answering 429, None disables it
+        self.rate_limit = rate_limit
+        # Seeded so failure sequences are reproducible
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        # Token bucket used for rate limiting
+        self.tokens = rate_limit or 0
+        self.last_refill = time.time()
+        # Counters reported by /__stats
+        self.stats = {'requests': 0, 'ok': 0, 'errors': 0, 'timeouts': 0,
+                      'not_found': 0, 'rate_limited': 0}
+
+    # Draw a latency in seconds from the configured distribution
+    def draw_latency(self):
+        """ Latency in seconds """
+        mean = self.latency_ms / 1000.0
+        if mean <= 0:
+            return 0.0
+        if self.latency == 'uniform':
+            return self.random.uniform(0, 2 * mean)
+        if self.latency == 'exponential':
+            return self.random.expovariate(1 / mean)
+        if self.latency == 'lognormal':
+            # Choose mu so the distribution mean matches latency_ms
+            sigma = self.latency_sigma
+            return self.random.lognormvariate(math.log(mean) - sigma * sigma / 2, sigma)
+        return mean
+
+    # Take a token from the rate limit bucket
+    def take_token(self):
+        """ Return False if the rate limit has been exceeded """
+        if self.rate_limit is None:
+            return True
+        now = time.time()
+        self.tokens = min(self.rate_limit,
+                          self.tokens + (now - self.last_refill) * self.rate_limit)
+        self.last_refill = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+    # Decide the outcome of a request
+    def respond(self, query):
+        """ Return (delay seconds, status code, payload) for a request """
+        title = query.get('t', [''])[0]
+        with self.lock:
+            self.stats['requests'] += 1
+            delay = self.draw_latency()
+            roll = self.random.random()
+            if not self.take_token():
+                outcome = 'rate_limited'
+            elif roll < self.error_rate:
+                outcome = 'errors'
+            elif roll < self.error_rate + self.timeout_rate:
+                outcome = 'timeouts'
+            elif roll < self.error_rate + self.timeout_rate + self.not_found_rate:
+                outcome = 'not_found'
+            else:
+                outcome = 'ok'
+            self.stats[outcome] += 1
+
+        if outcome == 'rate_limited':
+            return 0.0, 429, OMDB_RATE_LIMITED
+        if outcome == 'errors':
+            return delay, 500, None
+        if outcome == 'timeouts':
+            return self.timeout_seconds, 200, movie_payload(title)
+        if outcome == 'not_found' or not title:
+            return delay, 200, OMDB_NOT_FOUND if title else OMDB_NO_TITLE
+        return delay, 200, movie_payload(title)
+
+
+class FakeOMDBHandler(BaseHTTPRequestHandler):
+    """ Serve OMDB style GET requests """
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """ Answer a request """
+        url = urlparse(self.path)
+        if url.path == '/__stats':
+            return self.send_json(200, dict(self.server.fake.stats))
+        delay, status, payload = self.server.fake.respond(parse_qs(url.query))
+        if delay:
+            time.sleep(delay)
+        return self.send_json(status, payload)
+
+    def send_json(self, status, payload):
+        """ Send a JSON body, or a plain error body if payload is None """
+        body = b'Internal Server Error' if payload is None else json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        if status == 429:
+            self.send_header('Retry-After', '1')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """ Keep benchmark output quiet """
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """ One thread per request, like the app itself """
+    daemon_threads = True
+
+
+# Start the fake service on a background thread
+def serve(fake, host='127.0.0.1', port=0):
+    """ Start serving fake on host:port, port 0 picks a free port. Returns the server """
+    server = ThreadingHTTPServer((host, port), FakeOMDBHandler)
+    server.fake = fake
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+# Base url to set as OMDB_BASE_URL for a running server
+def base_url(server):
+    """ Base url of a running fake server """
+    host, port = server.server_address[:2]
+    return 'http://{}:{}'.format(host, port)
+
+
+# Add fake service options to an argument parser
+def add_arguments(parser):
+    """ Add fake OMDB behaviour options to parser """
+    parser.add_argument('--omdb-latency', choices=LATENCY_DISTRIBUTIONS, default='fixed')
+    parser.add_argument('--omdb-latency-ms', type=float, default=0.0, help='mean latency')
+    parser.add_argument('--omdb-latency-sigma', type=float, default=0.5,
+                        help='sigma for lognormal latency')
+    parser.add_argument('--omdb-error-rate', type=float, default=0.0)
+    parser.add_argument('--omdb-timeout-rate', type=float, default=0.0)
+    parser.add_argument('--omdb-timeout-seconds', type=float, default=30.0)
+    parser.add_argument('--omdb-not-found-rate', type=float, default=0.0)
+    parser.add_argument('--omdb-rate-limit', type=float, default=None,
+                        help='requests per second before answering 429')
+
+
+# Build a FakeOMDB from parsed options
+def from_arguments(args):
+    """ FakeOMDB configured from add_arguments options """
+    return FakeOMDB(
+        latency=args.omdb_latency, latency_ms=args.omdb_latency_ms,
+        latency_sigma=args.omdb_latency_sigma, error_rate=args.omdb_error_rate,
+        timeout_rate=args.omdb_timeout_rate, timeout_seconds=args.omdb_timeout_seconds,
+        not_found_rate=args.omdb_not_found_rate, rate_limit=args.omdb_rate_limit,
+        seed=args.seed)
+
+
+def main():
+    """ Run a local OMDB stand-in, point the app at it with OMDB_BASE_URL """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=10780)
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    server = serve(from_arguments(args), args.host, args.port)
+    print('Fake OMDB serving on {}, export OMDB_BASE_URL={}'.format(
+        base_url(server), base_url(server)))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
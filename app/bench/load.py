@@ -0,0 +1,269 @@
+""" Replay a request mix against the app and report throughput and latency """
+
+import os
+import re
+import ast
+import json
+import time
+import random
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from app.bench.seed import seed, parse_scale
+from app.bench import fake_omdb
+
+# Default request mix shipped with the benchmark suite
+DEFAULT_MIX = os.path.join(os.path.abspath(os.path.dirname(__file__)), 'mix.jsonl')
+# Percentiles reported per endpoint
+PERCENTILES = (50, 95, 99)
+
+
+# Load request mix
+def load_mix(path):
+    """ Load request mix from a JSONL file, one request per line """
+    mix = []
+    with open(path) as mix_file:
+        for line in mix_file:
+            line = line.strip()
+            if line:
+                mix.append(json.loads(line))
+    return mix
+
+
+# Build the list of requests to send
+def build_schedule(mix, total, movies, seed_=0):
+    """ Cycle through the mix filling in {movie_id} and {n} placeholders """
+    rand = random.Random(seed_)
+    schedule = []
+    for n in range(total):
+        entry = mix[n % len(mix)]
+        # Values available to placeholders in path, body and remote_addr
+        values = {'movie_id': rand.randint(1, movies), 'n': n}
+        body = entry.get('json')
+        if body is not None:
+            body = json.loads(json.dumps(body).replace('{n}', str(n)))
+        schedule.append({
+            'name': entry.get('name') or endpoint_name(entry['method'], entry['path']),
+            'method': entry['method'],
+            'path': entry['path'].format(**values),
+            'json': body,
+            'remote_addr': entry.get('remote_addr', '127.0.0.1').format(**values),
+        })
+    return schedule
+
+
+# Group requests e.g. GET /movies/12 and GET /movies/7 under GET /movies/<id>
+def endpoint_name(method, path):
+    """ Endpoint name from method and path template """
+    path = path.split('?')[0]
+    path = re.sub(r'/(\d+|\{movie_id\})(?=/|$)', '/<id>', path)
+    return '{} {}'.format(method.upper(), path)
+
+
+class InProcessClient:
+    """ Send requests through the flask test client """
+
+    def __init__(self, overrides=None):
+        # Config overrides e.g. WRITE_BEHIND=True, applied before the app is built
+        from app.config import Config
+        for key, value in (overrides or {}).items():
+            setattr(Config, key, value)
+        # Import here so YMDB_DB_LOC is read after it has been set
+        from app.run import app
+        self.client = app.test_client()
+
+    def send(self, request):
+        """ Send request and return status code """
+        response = self.client.open(
+            request['path'], method=request['method'], json=request['json'],
+            environ_base={'REMOTE_ADDR': request['remote_addr']})
+        return response.status_code
+
+
+class SocketClient:
+    """ Send requests to a running server over a local socket """
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        # A session per thread so connections are kept alive
+        self.local = threading.local()
+
+    def send(self, request):
+        """ Send request and return status code """
+        import requests
+        if not hasattr(self.local, 'session'):
+            self.local.session = requests.Session()
+        response = self.local.session.request(
+            request['method'], self.base_url + request['path'], json=request['json'])
+        return response.status_code
+
+
+# Send every request in the schedule and time each one
+def run(client, schedule, concurrency):
+    """ Replay schedule with the given concurrency, return timings and wall time """
+    def timed(request):
+        """ Time a single request """
+        start = time.perf_counter()
+        try:
+            status = client.send(request)
+        except Exception:  # pylint: disable=broad-except
+            status = None
+        return request['name'], status, time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        timings = list(executor.map(timed, schedule))
+    return timings, time.perf_counter() - start
+
+
+# Nearest rank percentile of a sorted list
+def percentile(sorted_values, pct):
+    """ Nearest rank percentile """
+    if not sorted_values:
+        return None
+    index = max(0, int(round(pct / 100.0 * len(sorted_values))) - 1)
+    return sorted_values[min(index, len(sorted_values) - 1)]
+
+
+# Summarise timings per endpoint
+def summarise(timings, elapsed):
+    """ Requests per second and latency percentiles per endpoint, in ms """
+    grouped = {}
+    for name, status, latency in timings:
+        grouped.setdefault(name, []).append((status, latency))
+
+    endpoints = {}
+    for name, results in sorted(grouped.items()):
+        latencies = sorted(latency * 1000 for _, latency in results)
+        summary = {
+            'count': len(results),
+            'errors': sum(1 for status, _ in results if status is None or status >= 500),
+            'rps': len(results) / elapsed,
+            'mean': sum(latencies) / len(latencies),
+        }
+        for pct in PERCENTILES:
+            summary['p{}'.format(pct)] = percentile(latencies, pct)
+        endpoints[name] = summary
+    return endpoints
+
+
+# Parse KEY=VALUE config overrides
+def parse_overrides(pairs):
+    """ Config overrides from KEY=VALUE strings, values are python literals """
+    overrides = {}
+    for pair in pairs:
+        key, value = pair.split('=', 1)
+        try:
+            overrides[key] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            overrides[key] = value
+    return overrides
+
+
+# Fake OMDB options recorded with the results
+def fake_omdb_options(args):
+    """ Fake OMDB behaviour as a dict """
+    return {key: value for key, value in vars(args).items() if key.startswith('omdb_')}
+
+
+# Print a results table
+def report(results, previous=None):
+    """ Print results, with deltas against a previous run if given """
+    print('{} requests in {:.2f}s, {:.1f} req/s'.format(
+        results['requests'], results['elapsed'], results['rps']))
+    print('{:<28} {:>7} {:>6} {:>9} {:>9} {:>9} {:>9}'.format(
+        'endpoint', 'count', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for name, summary in results['endpoints'].items():
+        print('{:<28} {:>7} {:>6} {:>9.1f} {:>9.2f} {:>9.2f} {:>9.2f}'.format(
+            name, summary['count'], summary['errors'], summary['rps'],
+            summary['p50'], summary['p95'], summary['p99']))
+        # Show change against previous run for the same endpoint
+        before = (previous or {}).get('endpoints', {}).get(name)
+        if before:
+            print('{:<28} {:>7} {:>6} {:>+9.1f} {:>+9.2f} {:>+9.2f} {:>+9.2f}'.format(
+                '  vs previous', '', '', summary['rps'] - before['rps'],
+                summary['p50'] - before['p50'], summary['p95'] - before['p95'],
+                summary['p99'] - before['p99']))
+
+
+def main():
+    """ Seed a database and replay a request mix against the app """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='JSONL request mix')
+    parser.add_argument('--db', default='bench.db', help='sqlite file to benchmark against')
+    parser.add_argument('--scale', default=None,
+                        help='seed a fresh database with 10k, 1m, 10m or a number of ratings')
+    parser.add_argument('--movies', type=int, default=None, help='number of movies to seed')
+    parser.add_argument('--mode', choices=['inprocess', 'socket'], default='inprocess')
+    parser.add_argument('--url', default='http://127.0.0.1:10702', help='server for socket mode')
+    parser.add_argument('--requests', type=int, default=1000, help='requests to send')
+    parser.add_argument('--concurrency', type=int, default=8, help='concurrent clients')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--output', default='bench_results', help='directory for JSON results')
+    parser.add_argument('--compare', default=None, help='previous JSON result to compare with')
+    parser.add_argument('--fake-omdb', action='store_true',
+                        help='serve OMDB from a local stand-in (in process mode only)')
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                        help='override a Config value in process mode e.g. WRITE_BEHIND=True')
+    fake_omdb.add_arguments(parser)
+    args = parser.parse_args()
+
+    db_path = os.path.abspath(args.db)
+    db_loc = 'sqlite:///{}'.format(db_path)
+    movies = args.movies
+    if args.scale:
+        # Always start from an empty database when seeding
+        if os.path.exists(db_path):
+            os.remove(db_path)
+        movies, _ = seed(db_loc, parse_scale(args.scale), movies=movies, seed_=args.seed)
+    if movies is None:
+        movies = 11
+
+    # In process mode the app reads its database from the environment
+    os.environ['YMDB_DB_LOC'] = db_loc
+    omdb_server = None
+    if args.fake_omdb:
+        # Enrichment goes to the local stand-in instead of the network
+        omdb_server = fake_omdb.serve(fake_omdb.from_arguments(args))
+        os.environ['OMDB_BASE_URL'] = fake_omdb.base_url(omdb_server)
+    if args.mode == 'inprocess':
+        client = InProcessClient(parse_overrides(args.set))
+    else:
+        client = SocketClient(args.url)
+
+    schedule = build_schedule(load_mix(args.mix), args.requests, movies, seed_=args.seed)
+    timings, elapsed = run(client, schedule, args.concurrency)
+    if omdb_server:
+        omdb_server.shutdown()
+
+    results = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'mode': args.mode,
+        'mix': os.path.basename(args.mix),
+        'scale': args.scale,
+        'movies': movies,
+        'concurrency': args.concurrency,
+        'config': args.set,
+        'omdb': fake_omdb_options(args) if args.fake_omdb else 'live',
+        'requests': len(timings),
+        'elapsed': elapsed,
+        'rps': len(timings) / elapsed,
+        'endpoints': summarise(timings, elapsed),
+    }
+
+    previous = None
+    if args.compare:
+        with open(args.compare) as previous_file:
+            previous = json.load(previous_file)
+    report(results, previous)
+
+    # Save results so runs can be compared over time
+    os.makedirs(args.output, exist_ok=True)
+    output = os.path.join(args.output, 'load-{}.json'.format(time.strftime('%Y%m%d-%H%M%S')))
+    with open(output, 'w') as output_file:
+        json.dump(results, output_file, indent=2, sort_keys=True)
+    print('Results saved to {}'.format(output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+""" Seed a database for benchmarking at a configurable scale """
+
+import os
+import time
+import random
+import argparse
+from sqlalchemy import create_engine
+from app.models.models import Movie, Users, Ratings, BASE
+from app.constants import BENCH_SCALES, BENCH_MOVIE_TITLE, BENCH_CLIENTIP, MOVIE_LIST_MIN
+
+# Rows inserted per executemany call
+CHUNK_SIZE = 50000
+
+
+# Convert a scale name e.g. 10k/1m/10m or a number to a count of ratings
+def parse_scale(scale):
+    """ Convert scale name or number to a count of ratings """
+    if scale.lower() in BENCH_SCALES:
+        return BENCH_SCALES[scale.lower()]
+    return int(scale)
+
+
+# Seed database with movies, users and ratings
+def seed(db_loc, ratings, movies=None, seed_=0, chunk_size=CHUNK_SIZE):
+    """ Seed database at db_loc with the given number of ratings """
+    # Default to roughly a hundred ratings per movie
+    if movies is None:
+        movies = max(MOVIE_LIST_MIN, ratings // 100)
+    # Deterministic data so runs can be compared
+    rand = random.Random(seed_)
+
+    engine = create_engine(db_loc)
+    BASE.metadata.create_all(engine)
+    with engine.begin() as conn:
+        # Seeding is throwaway data, trade durability for speed
+        conn.execute('PRAGMA synchronous = OFF')
+        conn.execute('PRAGMA journal_mode = MEMORY')
+
+        # Insert movies
+        insert_chunked(conn, Movie.__table__, (
+            {'id': i, 'title': BENCH_MOVIE_TITLE.format(i), 'rating': rand.randint(1, 5)}
+            for i in range(1, movies + 1)), chunk_size)
+
+        # Ratings are keyed on user, so each rating comes from its own user
+        insert_chunked(conn, Users.__table__, (
+            {'id': i, 'clientip': BENCH_CLIENTIP.format(i)}
+            for i in range(1, ratings + 1)), chunk_size)
+        insert_chunked(conn, Ratings.__table__, (
+            {'user_id': i, 'movie_id': rand.randint(1, movies), 'rating': rand.randint(1, 5)}
+            for i in range(1, ratings + 1)), chunk_size)
+    engine.dispose()
+    return movies, ratings
+
+
+# Insert rows from a generator in chunks
+def insert_chunked(conn, table, rows, chunk_size):
+    """ Insert rows into table chunk_size rows at a time """
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            conn.execute(table.insert(), chunk)
+            chunk = []
+    if chunk:
+        conn.execute(table.insert(), chunk)
+
+
+def main():
+    """ Seed benchmark database from the command line """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--db', required=True, help='sqlite file to create')
+    parser.add_argument('--scale', default='10k', help='10k, 1m, 10m or a number of ratings')
+    parser.add_argument('--movies', type=int, default=None, help='number of movies')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    args = parser.parse_args()
+
+    # Always start from an empty database
+    if os.path.exists(args.db):
+        os.remove(args.db)
+
+    start = time.time()
+    movies, ratings = seed(
+        'sqlite:///{}'.format(os.path.abspath(args.db)),
+        parse_scale(args.scale), movies=args.movies, seed_=args.seed)
+    print('Seeded {} movies and {} ratings in {:.1f}s'.format(
+        movies, ratings, time.time() - start))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+""" Measure rating write throughput of ShardedSQLADAO as the shard count grows """
+
+import os
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask
+from app.config import Config
+from app.dao import ShardedSQLADAO
+
+
+# Build a sharded dao with its files in directory
+def build_dao(directory, shard_count):
+    """ ShardedSQLADAO with shard_count shards stored in directory """
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.config['SHARD_COUNT'] = shard_count
+    # Lock waits are expected here, keep them out of the slow query log
+    app.config['SLOW_QUERY_THRESHOLD'] = None
+    app.config['SHARD_LOC'] = 'sqlite:///{}/shard-{{}}.db'.format(directory)
+    app.config['USERS_SHARD_LOC'] = 'sqlite:///{}/users.db'.format(directory)
+    return ShardedSQLADAO(app)
+
+
+# Time concurrent rating writes against one shard count
+def measure(shard_count, movies, writes, concurrency, seed_=0):
+    """ Rating writes per second with shard_count shards """
+    directory = tempfile.mkdtemp(prefix='ymdb-shards-')
+    try:
+        dao = build_dao(directory, shard_count)
+        movie_ids = [dao.add_movie(title='Shard bench {}'.format(i), rating=3)['id']
+                     for i in range(movies)]
+        rand = random.Random(seed_)
+        # Ratings are keyed on user, so every write comes from a new user id
+        targets = [rand.choice(movie_ids) for _ in range(writes)]
+        user_ids = itertools.count(1)
+        lock = threading.Lock()
+
+        def write(movie_id):
+            """ One committed rating write """
+            with lock:
+                user_id = next(user_ids)
+            dao.add_rating(rating=rand.randint(1, 5), user_id=user_id, movie_id=movie_id)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(write, targets))
+        elapsed = time.perf_counter() - start
+        return {'shards': shard_count, 'writes': writes, 'elapsed': elapsed,
+                'writes_per_second': writes / elapsed}
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def main():
+    """ Rating write throughput by shard count """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--shards', default='1,2,4,8', help='comma separated shard counts')
+    parser.add_argument('--movies', type=int, default=200, help='movies to spread writes over')
+    parser.add_argument('--writes', type=int, default=2000, help='rating writes per run')
+    parser.add_argument('--concurrency', type=int, default=16, help='concurrent writers')
+    parser.add_argument('--seed', type=int, default=0, help='random seed')
+    parser.add_argument('--output', default='bench_results', help='directory for JSON results')
+    args = parser.parse_args()
+
+    results = []
+    print('{:>7} {:>8} {:>10} {:>10}'.format('shards', 'writes', 'seconds', 'writes/s'))
+    for shard_count in [int(count) for count in args.shards.split(',')]:
+        result = measure(shard_count, args.movies, args.writes, args.concurrency, args.seed)
+        results.append(result)
+        print('{shards:>7} {writes:>8} {elapsed:>10.2f} {writes_per_second:>10.1f}'.format(
+            **result))
+
+    # Save results so runs can be compared over time
+    os.makedirs(args.output, exist_ok=True)
+    output = os.path.join(args.output, 'shards-{}.json'.format(time.strftime('%Y%m%d-%H%M%S')))
+    with open(output, 'w') as output_file:
+        json.dump({'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'concurrency': args.concurrency, 'results': results},
+                  output_file, indent=2, sort_keys=True)
+    print('Results saved to {}'.format(output))
+
+
+if __name__ == '__main__':
+    main()
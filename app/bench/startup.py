@@ -0,0 +1,95 @@
+""" Measure worker cold start, import time and time to first response """
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import subprocess
+from statistics import median
+from app.bench import fake_omdb
+
+# Run in a fresh interpreter so nothing is already imported or connected
+WORKER = '''
+import json, time
+start = time.perf_counter()
+from app.run import app
+imported = time.perf_counter()
+response = app.test_client().get('/movies/1')
+answered = time.perf_counter()
+print(json.dumps({'import_ms': (imported - start) * 1000,
+                  'first_request_ms': (answered - imported) * 1000,
+                  'total_ms': (answered - start) * 1000,
+                  'status': response.status_code}))
+'''
+
+
+# Start one worker and time it
+def measure(env):
+    """ Timings of one fresh worker process """
+    output = subprocess.check_output([sys.executable, '-c', WORKER], env=env)
+    return json.loads(output.decode().strip().splitlines()[-1])
+
+
+# Median of each timing over several runs
+def summarise(runs):
+    """ Median and min of each timing """
+    summary = {'runs': len(runs), 'statuses': sorted({run['status'] for run in runs})}
+    for key in ('import_ms', 'first_request_ms', 'total_ms'):
+        values = [run[key] for run in runs]
+        summary[key] = {'median': median(values), 'min': min(values)}
+    return summary
+
+
+def main():
+    """ Cold start time with a new database and warm start with an existing one """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--runs', type=int, default=5, help='worker starts per scenario')
+    parser.add_argument('--output', default='bench_results', help='directory for JSON results')
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='ymdb-startup-')
+    # Enrichment goes to the local stand-in so network latency is not measured
+    omdb_server = fake_omdb.serve(fake_omdb.FakeOMDB())
+    env = dict(os.environ)
+    env['OMDB_BASE_URL'] = fake_omdb.base_url(omdb_server)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))] +
+        [path for path in [env.get('PYTHONPATH')] if path])
+    db_path = os.path.join(directory, 'startup.db')
+    env['YMDB_DB_LOC'] = 'sqlite:///{}'.format(db_path)
+
+    try:
+        cold = []
+        for _ in range(args.runs):
+            # Cold, a new database is created and seeded
+            if os.path.exists(db_path):
+                os.remove(db_path)
+            cold.append(measure(env))
+        # Warm, the database is already initialized
+        warm = [measure(env) for _ in range(args.runs)]
+    finally:
+        omdb_server.shutdown()
+        shutil.rmtree(directory, ignore_errors=True)
+
+    results = {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+               'cold': summarise(cold), 'warm': summarise(warm)}
+    print('{:<6} {:>12} {:>18} {:>10}'.format('start', 'import ms', 'first request ms', 'total ms'))
+    for name in ('cold', 'warm'):
+        summary = results[name]
+        print('{:<6} {:>12.1f} {:>18.1f} {:>10.1f}'.format(
+            name, summary['import_ms']['median'], summary['first_request_ms']['median'],
+            summary['total_ms']['median']))
+
+    # Save results so runs can be compared over time
+    os.makedirs(args.output, exist_ok=True)
+    output = os.path.join(args.output, 'startup-{}.json'.format(time.strftime('%Y%m%d-%H%M%S')))
+    with open(output, 'w') as output_file:
+        json.dump(results, output_file, indent=2, sort_keys=True)
+    print('Results saved to {}'.format(output))
+
+
+if __name__ == '__main__':
+    main()
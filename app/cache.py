@@ -0,0 +1,76 @@
+""" In-process caches """
+
+import time
+import threading
+from collections import OrderedDict
+
+
+class TTLCache:
+    """ Thread safe LRU cache whose entries expire after ttl seconds """
+
+    def __init__(self, max_size, ttl):
+        # Maximum entries before the least recently used is evicted
+        self.max_size = max_size
+        # Seconds an entry stays fresh
+        self.ttl = ttl
+        # Entries in least to most recently used order, key: (expires, value)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        # Counters for monitoring
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def get(self, key, default=None):
+        """ Fresh value for key, or default """
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] < time.time():
+                self.stats['misses'] += 1
+                return default
+            # Mark as most recently used
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return entry[1]
+
+    def __contains__(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry is not None and entry[0] >= time.time()
+
+    def set(self, key, value):
+        """ Store value for key, evicting the least recently used entries if full """
+        with self.lock:
+            self.entries[key] = (time.time() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class ResponseCache(TTLCache):
+    """ TTLCache of serialized response bodies, capped by total size in bytes """
+
+    def __init__(self, max_bytes, ttl):
+        # Size rather than entry count bounds this cache
+        super().__init__(None, ttl)
+        # Maximum total size of cached bodies
+        self.max_bytes = max_bytes
+        # Total size of cached bodies
+        self.size = 0
+
+    def set(self, key, value):
+        """ Store body for key, evicting the least recently used bodies to stay under max_bytes """
+        if len(value) > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[1])
+            self.entries[key] = (time.time() + self.ttl, value)
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.stats['evictions'] += 1
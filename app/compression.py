@@ -0,0 +1,71 @@
+""" Negotiated response compression """
+
+import gzip
+
+# Brotli is optional, gzip is always available
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Encodings we can produce, in order of preference
+SUPPORTED_ENCODINGS = ['br', 'gzip'] if brotli else ['gzip']
+
+
+# Pick an encoding from an Accept-Encoding header
+def choose_encoding(accept_encoding):
+    """ Preferred supported encoding the client accepts, or None """
+    accepted = {}
+    for part in (accept_encoding or '').split(','):
+        # e.g. 'gzip;q=0.8'
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            accepted[name.lower()] = quality
+
+    best = None
+    for encoding in SUPPORTED_ENCODINGS:
+        quality = accepted.get(encoding, accepted.get('*', 0.0))
+        if quality > 0 and (best is None or quality > best[1]):
+            best = (encoding, quality)
+    return best[0] if best else None
+
+
+# Compress a body
+def compress(body, encoding, config):
+    """ Body compressed with encoding at the configured level """
+    if encoding == 'br':
+        return brotli.compress(body, quality=config['BROTLI_QUALITY'])
+    return gzip.compress(body, compresslevel=config['GZIP_LEVEL'])
+
+
+# Compress a response in place if worthwhile
+def compress_response(response, accept_encoding, config):
+    """ Compress response body if the client accepts it and it is over the size threshold """
+    # Only plain buffered bodies that are not already encoded
+    if response.direct_passthrough or 'Content-Encoding' in response.headers or \
+            response.status_code < 200 or response.status_code >= 300:
+        return response
+    response.vary.add('Accept-Encoding')
+    body = response.get_data()
+    if len(body) < config['COMPRESS_MIN_SIZE']:
+        return response
+    encoding = choose_encoding(accept_encoding)
+    if encoding is None:
+        return response
+    set_encoded_body(response, compress(body, encoding, config), encoding)
+    return response
+
+
+# Set an already compressed body
+def set_encoded_body(response, body, encoding):
+    """ Replace response body with body compressed with encoding """
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
@@ -9,7 +9,17 @@ class Config: # pylint: disable=too-few-public-methods
     # LOG
     LOG = 'error.log'
     # Log level
-    LOG_LEVEL = logging.DEBUG
+    LOG_LEVEL = logging.INFO
+    # Per module log levels, keyed on logger name
+    LOG_LEVELS = {
+        'app.slow_query': logging.WARNING,
+        'sqlalchemy.engine': logging.WARNING,
+        'werkzeug': logging.INFO,
+    }
+    # Log file size before rollover
+    LOG_MAX_BYTES = 10000000
+    # Rolled over log files to keep
+    LOG_BACKUP_COUNT = 5
     # Log format
     LOG_FORMAT = '%(asctime)s | %(levelname)s | %(pathname)s:%(lineno)d | %(funcName)s ' \
         '| %(message)s'
@@ -25,13 +35,89 @@ class Config: # pylint: disable=too-few-public-methods
 
     # OMDB api access key
     API_KEY = '8bdd5583'
+    # Base URL to send get requests for third party ratings, point at app.bench.fake_omdb
+    # to run without network access
+    OMDB_BASE_URL = os.environ.get('OMDB_BASE_URL', 'http://www.omdbapi.com')
+    # Concurrent OMDB lookups when enriching a batch of movies
+    OMDB_BATCH_CONCURRENCY = 8
+    # Seconds third party ratings are cached for
+    OMDB_CACHE_TTL = 3600
+    # Maximum titles in the third party ratings cache
+    OMDB_CACHE_SIZE = 100000
+
+    # Maximum total size of cached list response bodies, 0 disables the cache
+    RESPONSE_CACHE_MAX_BYTES = 64 * 1024 * 1024
+    # Seconds a cached list response is served for, writes invalidate it sooner
+    RESPONSE_CACHE_TTL = 300
+
+    # Smallest response body in bytes worth compressing
+    COMPRESS_MIN_SIZE = 1024
+    # gzip compression level
+    GZIP_LEVEL = 6
+    # brotli compression quality, used when the brotli package is installed
+    BROTLI_QUALITY = 5
+
+    # Warm the third party ratings cache when the server starts
+    WARMUP_ON_STARTUP = True
+    # Most recently added movies to warm
+    WARMUP_LIMIT = 1000
+    # Maximum OMDB requests per second while warming
+    WARMUP_RATE = 5
 
     # SQLDAO type
     DAO_TYPE = 'SQLADAO'
     # DB Name
     DB_NAME = 'ymdb.db'
-    # SQLITE3 DB Location
-    DB_LOC = 'sqlite:///{}/ymdb.db'.format(BASEDIR)
+    # SQLITE3 DB Location, YMDB_DB_LOC overrides e.g. for benchmarks
+    DB_LOC = os.environ.get('YMDB_DB_LOC', 'sqlite:///{}/ymdb.db'.format(BASEDIR))
     # Implemented DAOS
-    IMPLEMENTED_DAOS = ['SQLADAO']
+    IMPLEMENTED_DAOS = ['SQLADAO', 'ShardedSQLADAO']
+    # ShardedSQLADAO number of movie shards, changing it requires a fresh set of shard files
+    SHARD_COUNT = 4
+    # ShardedSQLADAO movie shard locations, formatted with the shard index
+    SHARD_LOC = os.environ.get(
+        'YMDB_SHARD_LOC', 'sqlite:///{}/ymdb-shard-{{}}.db'.format(BASEDIR))
+    # ShardedSQLADAO shared users shard location
+    USERS_SHARD_LOC = os.environ.get(
+        'YMDB_USERS_SHARD_LOC', 'sqlite:///{}/ymdb-users.db'.format(BASEDIR))
+
+    # Queue validated rating writes and apply them in batches on a writer thread
+    WRITE_BEHIND = False
+    # Maximum rating writes waiting to be applied
+    WRITE_QUEUE_SIZE = 10000
+    # Maximum rating writes applied in one transaction
+    WRITE_BATCH_SIZE = 500
+    # Seconds a request waits for room in a full queue before a 503 is returned
+    WRITE_QUEUE_TIMEOUT = 0.5
+
+    # Ratings read into memory at once, and movies written per transaction, by app.rebuild
+    REBUILD_CHUNK_SIZE = 1000000
+
+    # Similar movies index written by app.similarity and memory-mapped by the server
+    SIMILARITY_INDEX = os.environ.get(
+        'YMDB_SIMILARITY_INDEX', '{}/similar-movies.npy'.format(BASEDIR))
+    # Most similar movies stored per movie, the most GET /movies/{id}/similar can return
+    SIMILARITY_TOP_K = 20
+    # Movies whose similarities to every other movie are computed at once while building
+    SIMILARITY_BLOCK_SIZE = 1000
+
+    # Slow query log, level set in LOG_LEVELS
+    SLOW_QUERY_LOG = 'slow_query.log'
+    # Seconds a statement may take before it is written to the slow query log
+    SLOW_QUERY_THRESHOLD = 0.1
+    # Maximum statements per request, None disables the check
+    MAX_QUERIES_PER_REQUEST = None
+    # Action when MAX_QUERIES_PER_REQUEST is exceeded, 'warn' or 'raise'
+    MAX_QUERIES_ACTION = 'warn'
+
+    # Maximum requests in flight per route class, None leaves a class unbounded
+    ADMISSION_LIMITS = {'read': 64, 'write': 16, 'enrichment': 32}
+    # Seconds a request waits for a free slot before a 503 is returned, 0 sheds at once
+    ADMISSION_TIMEOUT = 0
+    # Requests per second allowed per client address, None disables rate limiting
+    RATE_LIMIT_PER_SECOND = 20
+    # Requests a client may burst above RATE_LIMIT_PER_SECOND after being idle
+    RATE_LIMIT_BURST = 40
+    # Client buckets kept before idle ones are dropped
+    RATE_LIMIT_MAX_CLIENTS = 100000
 
@@ -6,28 +6,35 @@ OMDB_RATINGS = {
     'Internet Movie Database': 'imdbRating',
     'Metacritic': 'metascore'
 }
-# Base URL to send get requests for third party ratings
-OMDB_BASE_URL = 'http://www.omdbapi.com'
 
 """ Logger Constants """
 # Log user attempting to access movie list with ip
-USER_ACCESSING_MOVIE_LIST = '{}: Attempting to access movie list'
+USER_ACCESSING_MOVIE_LIST = '%s: Attempting to access movie list'
 # Log user accessed movie list with ip
-USER_ACCESSED_MOVIE_LIST = '{}: User accessed movie list'
+USER_ACCESSED_MOVIE_LIST = '%s: User accessed movie list'
 # Log user attempting to add movie to list with ip, movie name, and rating
-USER_ADDING_TO_MOVIE_LIST = '{}: User adding movie "{}" with rating {} to movie list'
+USER_ADDING_TO_MOVIE_LIST = '%s: User adding movie "%s" with rating %s to movie list'
 # Log user adding movie to list with ip, movie name, and rating
-USER_ADDED_TO_MOVIE_LIST = '{}: User added movie "{}" with rating {} to movie list'
+USER_ADDED_TO_MOVIE_LIST = '%s: User added movie "%s" with rating %s to movie list'
 # Log user attempting to update movie in list with ip, movie name, and rating
-USER_UPDATING_MOVIE_IN_LIST = '{}: User updating movie "{}" with rating {} in movie list'
+USER_UPDATING_MOVIE_IN_LIST = '%s: User updating movie "%s" with rating %s in movie list'
 # Log user updated movie in list with ip, movie name, and rating
-USER_UPDATED_MOVIE_IN_LIST = '{}: User updated movie "{}" with rating {} in movie list'
+USER_UPDATED_MOVIE_IN_LIST = '%s: User updated movie "%s" with rating %s in movie list'
+# Log user rating queued for write-behind with ip, movie name, and rating
+USER_QUEUED_RATING = '%s: User rating of movie "%s" with rating %s queued'
+# Log user attempting to access movies by ids with ip and number of ids
+USER_ACCESSING_MOVIES_BY_IDS = '%s: User attempting to access %d movies by id'
+# Log user accessed movies by ids with ip, number found and number of ids
+USER_ACCESSED_MOVIES_BY_IDS = '%s: User accessed %d of %d movies by id'
 # Log user attempting to access movie in list by id with ip and movie id
-USER_ACCESSING_MOVIE_BY_ID = '{}: User attempting to access movie by id {}'
+USER_ACCESSING_MOVIE_BY_ID = '%s: User attempting to access movie by id %s'
 # Log user accessed movie in list by id with ip and movie id
-USER_ACCESSED_MOVIE_BY_ID = '{}: User accessed movie "{}" by id {}'
+USER_ACCESSED_MOVIE_BY_ID = '%s: User accessed movie "%s" by id %s'
+# Log user accessed movie rating distribution with ip and movie id
+USER_ACCESSED_DISTRIBUTION = '%s: User accessed rating distribution of movie %s'
 # Log Application Error
-APPLICATION_ERROR = '{}: Something went wrong!'
+APPLICATION_ERROR = '%s: Something went wrong!'
+
 # Schema to validate post/put json
 POST_PUT_SCHEMA = {
     "type" : "object",
@@ -57,10 +64,107 @@ MOVIE_LIST_LIMIT_ERROR = 'Number of movies to return must be between {} and {}!'
 MOVIE_LIST_RATING_ERROR = 'Rating must be between 1 and 5!'
 # Movie already exists error
 MOVIE_ALREADY_EXISTS = 'Movie already exists, update via PUT!'
+# Movie does not exist with id error
+MOVIE_ID_DOES_NOT_EXIST = 'Movie does not exist with id {}!'
+# Rating distribution buckets, whole stars
+RATING_BUCKETS = (1, 2, 3, 4, 5)
+# Movie columns that can be selected with ?fields=
+MOVIE_FIELDS = ['id', 'title', 'rating']
+# Unknown fields request error with permitted fields
+MOVIE_FIELDS_ERROR = 'fields must be from {}!'
+# Maximum ids in one batch request
+MOVIE_BATCH_MAX = 1000
+# Batch ids request error
+MOVIE_BATCH_IDS_ERROR = 'ids must be between 1 and {} comma separated movie ids!'
+# Schema to validate batch post json
+BATCH_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "ids": {"type": "array", "items": {"type": "integer"}},
+    },
+    "required": ["ids"],
+    "additionalProperties": False
+}
 # Movie does not exist exists error
 MOVIE_DOES_NOT_EXIST = 'Movie does not exist, add via POST!'
+# Schema version, bump when tables or initial data change
+SCHEMA_VERSION = 2
 # Initial data to add to db
 INITIAL_DB_DATA = [
     {'title': 'Batman Begins', 'rating': '4.2'},
     {'title': 'The Dark Knight', 'rating': '3'},
 ]
+
+""" Query Instrumentation Constants """
+# Name of logger that receives slow statements
+SLOW_QUERY_LOGGER = 'app.slow_query'
+# Log slow statement with elapsed ms, statement and parameters
+SLOW_QUERY = 'Slow query (%.1f ms): %s | parameters: %r'
+# Log statements issued by a request with path, count and elapsed ms
+REQUEST_QUERY_SUMMARY = '%s: %d queries in %.1f ms'
+# Request issued too many statements with path, count and limit
+TOO_MANY_QUERIES = '%s: issued %d queries, limit is %d'
+
+""" Write-behind Constants """
+# Rating write queue is full error
+WRITE_QUEUE_FULL = 'Too many pending rating writes, retry later!'
+# Seconds clients are asked to wait before retrying when the write queue is full
+WRITE_QUEUE_RETRY_AFTER = 1
+# Log batch applied with applied and failed counts
+WRITE_BATCH_APPLIED = 'Write-behind batch applied %d, failed %d'
+# Log batch failed with batch size
+WRITE_BATCH_FAILED = 'Write-behind batch of %d writes failed'
+# Log writer stopped with number of writes applied
+WRITE_QUEUE_FLUSHED = 'Write-behind queue flushed, %d writes applied'
+
+""" Admission Control Constants """
+# Route class concurrency limit reached error
+ADMISSION_REJECTED = 'Server is busy, retry later!'
+# Seconds clients are asked to wait before retrying when a route class is full
+ADMISSION_RETRY_AFTER = 1
+# Client rate limit exceeded error
+RATE_LIMITED = 'Too many requests, retry later!'
+# Routes that may call OMDB, counted as enrichment unless ?external=false
+ENRICHED_ENDPOINTS = ('list_movies', 'batch_movies', 'get_movie_by_id')
+# Log request shed with route class and client ip
+ADMISSION_SHED = 'Shed %s request from %s'
+# Log client rate limited with client ip and seconds until retry
+CLIENT_RATE_LIMITED = 'Rate limited %s, retry in %.2fs'
+
+""" Cache Warm-up Constants """
+# Log progress every this many movies
+WARMUP_PROGRESS_EVERY = 100
+# Log warm-up progress with movies done and total
+WARMUP_PROGRESS = 'Cache warm-up %d/%d movies'
+# Log warm-up complete with warmed, skipped, failed and seconds
+WARMUP_COMPLETE = 'Cache warm-up complete, %d warmed, %d skipped, %d failed in %.1fs'
+# Log warm-up of a title failed with title
+WARMUP_FAILED = 'Cache warm-up of "%s" failed'
+
+""" Aggregate Rebuild Constants """
+# Log rebuild progress with database, ratings read and ratings per second
+REBUILD_PROGRESS = '%s: read %d ratings (%.0f/s)'
+# Log rebuild complete with database, ratings read, movies rated, movies written and seconds
+REBUILD_COMPLETE = '%s: rebuilt aggregates from %d ratings of %d movies, wrote %d movies in %.1fs'
+
+""" Similar Movies Constants """
+# Similar movies index has not been built error
+SIMILARITY_INDEX_MISSING = 'Similar movies are not available yet, retry later!'
+# Similar movies limit out of range error, formatted with the maximum
+SIMILAR_LIMIT_ERROR = 'Number of similar movies to return must be between 1 and {}!'
+# Log ratings read while building with database and total ratings read
+SIMILARITY_READ = '%s: read ratings, %d in total'
+# Log build progress with movies done and total
+SIMILARITY_PROGRESS = 'Similar movies %d/%d'
+# Log build complete with movies, ratings, index file and seconds
+SIMILARITY_COMPLETE = 'Indexed similar movies of %d movies from %d ratings to %s in %.1fs'
+# Log user accessed similar movies with ip, movie id and number found
+USER_ACCESSED_SIMILAR = '%s: User accessed %d movies similar to movie %s'
+
+""" Benchmark Constants """
+# Named benchmark scales as number of ratings
+BENCH_SCALES = {'10k': 10000, '1m': 1000000, '10m': 10000000}
+# Title of seeded movie with movie id
+BENCH_MOVIE_TITLE = 'Bench movie {}'
+# Client ip of seeded user with user id
+BENCH_CLIENTIP = 'bench-{}'
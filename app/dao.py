@@ -1,11 +1,16 @@
 """ DAO for persistence """
 
-import os
+import zlib
+import heapq
+import itertools
+import threading
 from abc import ABCMeta, abstractmethod
-from sqlalchemy import create_engine, desc, func, update
-from sqlalchemy.orm import sessionmaker
-from app.models.models import Movie, Users, Ratings, BASE
-from app.constants import INITIAL_DB_DATA
+from sqlalchemy import create_engine, desc, func, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import sessionmaker, scoped_session
+from app.models.models import Movie, Users, Ratings, RatingDistribution, SchemaVersion, BASE
+from app.constants import INITIAL_DB_DATA, SCHEMA_VERSION, RATING_BUCKETS
+from app.query_stats import QueryStats
 
 # Interface
 class DAO(metaclass=ABCMeta):
@@ -33,6 +38,10 @@ class DAO(metaclass=ABCMeta):
     @abstractmethod
     def get_movie_by_id(self, **kwargs): pass
 
+    # Required to get many movies by id
+    @abstractmethod
+    def get_movies_by_ids(self, **kwargs): pass
+
     # Required to add movie
     @abstractmethod
     def add_movie(self, **kwargs): pass
@@ -53,37 +62,101 @@ class DAO(metaclass=ABCMeta):
     @abstractmethod
     def get_user_rating(self, **kwargs): pass
 
+    # Required to apply a batch of queued rating writes
+    @abstractmethod
+    def apply_rating_writes(self, **kwargs): pass
+
+    # Required to get a movie's rating distribution
+    @abstractmethod
+    def get_rating_distribution(self, **kwargs): pass
+
 
 class SQLADAO(DAO):
     """ DAO for sqlite """
 
-    def __init__(self, app):
-        # Add db location to object
-        self.db_loc = app.config['DB_LOC']
-        # Define attribute
-        self.session = None
-        # Object connection
-        self.connect()
+    def __init__(self, app, db_loc=None, query_stats=None, initial_data=INITIAL_DB_DATA):
+        # Add db location to object, shards pass their own location
+        self.db_loc = db_loc or app.config['DB_LOC']
+        # Movies added when the db is created
+        self.initial_data = initial_data
+        # Define attributes, the engine is created on first use
+        self.engine = None
+        self.session_registry = None
+        # Guards against concurrent first requests both connecting
+        self.connect_lock = threading.Lock()
+        # Bumped by every write so cached responses built from older data are never served
+        self.version_counter = itertools.count(1)
+        self.data_version = 0
+        # Per request statement counters and slow query log, shared between shards
+        self.query_stats = query_stats or QueryStats(app.config, app.logger)
 
     # Connect to database
     def connect(self):
         """ DB connection """
-        # Will connect to database
-        self.engine = create_engine(self.db_loc)
-        # If db does not exist create it
-        if not os.path.exists(self.db_loc):
+        with self.connect_lock:
+            # Already connected by another thread
+            if self.engine is not None:
+                return
+            # Will connect to database
+            engine = create_engine(self.db_loc)
+            # Count and time every statement issued on the engine
+            self.query_stats.instrument(engine)
+            # Create schema and insert initial items unless already done
+            self.bootstrap(engine)
+            # Sessions are per thread so concurrent requests never share one
+            self.session_registry = scoped_session(sessionmaker(bind=engine))
+            self.engine = engine
+
+    # Create schema and initial data
+    def bootstrap(self, engine):
+        """ Create tables and insert initial data in one transaction, once per schema version """
+        with engine.begin() as conn:
+            # Cheap check, a single select once the db has been initialized
+            if engine.dialect.has_table(conn, SchemaVersion.__tablename__):
+                version = conn.execute(select([func.max(SchemaVersion.version)])).scalar()
+                if version is not None and version >= SCHEMA_VERSION:
+                    return
+
             # Create all tables
-            BASE.metadata.create_all(self.engine)
-            # Insert all items in db
-            for item in INITIAL_DB_DATA:
-                self.add_movie(title=item['title'], rating=item['rating'])
-                
+            BASE.metadata.create_all(conn)
+            # Insert initial items in bulk, skipping any already there from older dbs
+            existing = {title for (title,) in conn.execute(select([Movie.title]))}
+            movies = [item for item in self.initial_data if item['title'] not in existing]
+            if movies:
+                conn.execute(Movie.__table__.insert(), movies)
+            # Backfill rating distributions from ratings made before they were maintained
+            if not conn.execute(select([func.count()]).select_from(RatingDistribution)).scalar():
+                distributions = {}
+                for movie_id, rating in conn.execute(select([Ratings.movie_id, Ratings.rating])):
+                    distribution = distributions.setdefault(
+                        movie_id, dict({bucket_column(bucket): 0 for bucket in RATING_BUCKETS},
+                                       movie_id=movie_id))
+                    distribution[bucket_column(rating_bucket(rating))] += 1
+                if distributions:
+                    conn.execute(RatingDistribution.__table__.insert(), list(distributions.values()))
+            # Record schema version so the next start skips all of this
+            conn.execute(SchemaVersion.__table__.insert(), {'version': SCHEMA_VERSION})
+
+    # Mark data as changed
+    def bump_data_version(self):
+        """ Invalidate responses cached against the current data version """
+        # next() on itertools.count is atomic, concurrent writers never share a version
+        self.data_version = next(self.version_counter)
+
+    # Session for the calling thread
+    @property
+    def session(self):
+        """ Current thread's db session """
+        return self.session_registry()
+
     # Start session with db
     def start_session(self):
         """ Start db session """
-        session_maker = sessionmaker(bind=self.engine)
-        # Add session to object
-        self.session = session_maker()
+        # Connect on first use
+        if self.engine is None:
+            self.connect()
+        # Make sure the calling thread has a fresh session
+        self.session_registry.remove()
 
     # Used to decorate similar queries
     def select_query(query):
@@ -101,6 +174,13 @@ class SQLADAO(DAO):
             return return_obj
         return wrap
 
+    # Query whole movies or selected columns
+    def movie_query(self, fields=None):
+        """ Query for Movie objects, or only the Movie columns named in fields """
+        if fields:
+            return self.session.query(*[getattr(Movie, field) for field in fields])
+        return self.session.query(Movie)
+
     # Will use select_query decorator
     @select_query
     def get_all_movies(self, **kwargs):
@@ -109,10 +189,10 @@ class SQLADAO(DAO):
         limit = kwargs['limit']
 
         # Query all movies descending on movie id with enforced limit
-        movies = self.session.query(Movie).order_by(desc(Movie.id)).limit(limit).all()
+        movies = self.movie_query(kwargs.get('fields')).order_by(desc(Movie.id)).limit(limit).all()
 
         # Convert to json and return
-        return convert_to_json(movies, Movie)
+        return convert_to_json(movies, Movie, kwargs.get('fields'))
 
     # Will use select_query decorator
     @select_query
@@ -122,12 +202,21 @@ class SQLADAO(DAO):
         return_obj = None
 
         # Query for movie, filtered by id
-        movie = self.session.query(Movie).filter_by(id=kwargs['id_']).first()
+        movie = self.movie_query(kwargs.get('fields')).filter(Movie.id == kwargs['id_']).first()
         if movie:
             # If movie exists convert to json before returning
-            return_obj = convert_to_json([movie], Movie)[0]
+            return_obj = convert_to_json([movie], Movie, kwargs.get('fields'))[0]
         return return_obj
 
+    # Will use select_query decorator
+    @select_query
+    def get_movies_by_ids(self, **kwargs):
+        """ Get many movies by id with a single IN query, in no particular order """
+        # Query for movies, filtered by ids
+        movies = self.movie_query(kwargs.get('fields')).filter(Movie.id.in_(kwargs['ids'])).all()
+        # Convert to json and return
+        return convert_to_json(movies, Movie, kwargs.get('fields'))
+
     # Will use select_query decorator
     @select_query
     def get_movie_by_title(self, **kwargs):
@@ -159,6 +248,7 @@ class SQLADAO(DAO):
 
             # Commit update to db
             self.session.commit()
+            self.bump_data_version()
 
         return_obj = convert_to_json([movie], Movie)[0]
         # Close session with db
@@ -176,6 +266,7 @@ class SQLADAO(DAO):
         movie.rating = kwargs['rating']
         # Commit update
         self.session.commit()
+        self.bump_data_version()
         # Close session with db
         self.session.close()
         #return error
@@ -210,20 +301,29 @@ class SQLADAO(DAO):
         # Start session with db
         self.start_session()
 
-        # Query to get the Ratings table
-        query = self.session.query(Ratings)
+        # Query for the user's existing rating of this movie
+        rating = self.session.query(Ratings).filter_by(
+            user_id=kwargs['user_id'], movie_id=kwargs['movie_id']).first()
 
-        # Update Rating object
-        rating = Ratings(
-            rating=kwargs['rating'],
-            user_id=kwargs['user_id'],
-            movie_id=kwargs['movie_id'])
+        if rating:
+            # Move the old rating out of its bucket and replace it
+            self.count_rating(rating.movie_id, rating.rating, -1)
+            rating.rating = kwargs['rating']
+        else:
+            # Update Rating object
+            rating = Ratings(
+                rating=kwargs['rating'],
+                user_id=kwargs['user_id'],
+                movie_id=kwargs['movie_id'])
 
-        # Add updated object to session
-        self.session.add(rating)
+            # Add updated object to session
+            self.session.add(rating)
+        # Count the new rating in the same transaction
+        self.count_rating(kwargs['movie_id'], kwargs['rating'], 1)
 
         # Commit updated object to db
         self.session.commit()
+        self.bump_data_version()
 
         # Close session with db
         self.session.close()
@@ -253,17 +353,99 @@ class SQLADAO(DAO):
             movie_id=kwargs['movie_id']).scalar()
         return rating
 
+    def apply_rating_writes(self, **kwargs):
+        """ Apply queued rating writes in one transaction, returns (applied, failed) """
+        writes = kwargs['writes']
+        # Start session with db
+        self.start_session()
+        try:
+            # Group commit, one transaction for the whole batch
+            for write in writes:
+                self.apply_rating_write(write)
+            self.session.commit()
+            applied, failed = len(writes), 0
+        except SQLAlchemyError:
+            self.session.rollback()
+            # Apply one at a time so a single bad write does not lose the batch
+            applied, failed = 0, 0
+            for write in writes:
+                try:
+                    self.apply_rating_write(write)
+                    self.session.commit()
+                    applied += 1
+                except SQLAlchemyError:
+                    self.session.rollback()
+                    failed += 1
+        self.bump_data_version()
+        # Close session with db
+        self.session.close()
+        return applied, failed
+
+    def apply_rating_write(self, write):
+        """ Add a queued rating write to the current session """
+        # Query for movie, filtered by title
+        movie = self.session.query(Movie).filter(Movie.title.like(write['title'])).first()
+        if not movie:
+            # Add movie and flush so it gets an id
+            movie = Movie(title=write['title'], rating=write['rating'])
+            self.session.add(movie)
+            self.session.flush()
+        # Add user rating, a PUT replaces the user's existing rating
+        rating = Ratings(rating=write['rating'], user_id=write['user_id'], movie_id=movie.id)
+        if write['method'] == 'PUT':
+            # Move the replaced rating out of its bucket
+            old = self.session.query(Ratings).get(write['user_id'])
+            if old:
+                self.count_rating(old.movie_id, old.rating, -1)
+            self.session.merge(rating)
+        else:
+            self.session.add(rating)
+        self.count_rating(movie.id, write['rating'], 1)
+        # Update movie rating as the synchronous path does
+        movie.rating = write['rating']
+
+    # Move a rating into or out of its movie's distribution
+    def count_rating(self, movie_id, rating, delta):
+        """ Add delta to the bucket of rating in movie_id's distribution, in the current session """
+        column = bucket_column(rating_bucket(rating))
+        # Increment in SQL so concurrent writers never lose a count
+        updated = self.session.query(RatingDistribution).filter_by(movie_id=movie_id).update(
+            {column: getattr(RatingDistribution, column) + delta}, synchronize_session=False)
+        if not updated and delta > 0:
+            # First rating of this movie
+            self.session.add(RatingDistribution(
+                movie_id=movie_id, **dict({bucket_column(bucket): 0 for bucket in RATING_BUCKETS},
+                                          **{column: delta})))
+            self.session.flush()
+
+    # Will use select_query decorator
+    @select_query
+    def get_rating_distribution(self, **kwargs):
+        """ Get a movie's rating bucket counts by primary key, None if there is no such movie """
+        # Single primary key lookup, movies without ratings have no distribution row
+        row = self.session.query(Movie.id, RatingDistribution).outerjoin(
+            RatingDistribution, RatingDistribution.movie_id == Movie.id).filter(
+                Movie.id == kwargs['movie_id']).first()
+        if row is None:
+            return None
+        return {str(bucket): getattr(row[1], bucket_column(bucket)) if row[1] else 0
+                for bucket in RATING_BUCKETS}
+
     # Delete User
     def delete_user(self, **kwargs):
         """ Delete User and their ratings, used for testing, unimplemeneted for client use """
         # Start session with db
         self.start_session()
+        # Move user ratings out of their buckets
+        for rating in self.session.query(Ratings).filter_by(user_id=kwargs['user_id']):
+            self.count_rating(rating.movie_id, rating.rating, -1)
         # Query for and delete user ratings
         self.session.query(Ratings).filter_by(user_id=kwargs['user_id']).delete()
         # Query for and delete user
         self.session.query(Users).filter_by(id=kwargs['user_id']).delete()
         # Commit 
         self.session.commit()
+        self.bump_data_version()
         # Close session with db
         self.session.close()
 
@@ -275,22 +457,166 @@ class SQLADAO(DAO):
 
         if 'id_' in kwargs:
             # Query for movie by id
-            self.session.query(Movie).filter_by(id=kwargs['id_']).delete()
+            movies = self.session.query(Movie).filter_by(id=kwargs['id_'])
         else:
             # Query for movie by title
-            self.session.query(Movie).filter_by(title=kwargs['title']).delete()
+            movies = self.session.query(Movie).filter_by(title=kwargs['title'])
+        # Delete the movie's rating distribution with it
+        self.session.query(RatingDistribution).filter(
+            RatingDistribution.movie_id.in_([movie.id for movie in movies])).delete(
+                synchronize_session=False)
+        movies.delete()
 
         # Commit delete
         self.session.commit()
+        self.bump_data_version()
 
         # Close session with db
         self.session.close()
 
 
+class ShardedSQLADAO(DAO):
+    """ DAO partitioning movies and their ratings across several sqlite files """
+
+    def __init__(self, app):
+        # Statement counters shared by every shard
+        self.query_stats = QueryStats(app.config, app.logger)
+        # Number of movie shards
+        self.shard_count = app.config['SHARD_COUNT']
+        # Users live in a small shared shard
+        self.users = SQLADAO(
+            app, db_loc=app.config['USERS_SHARD_LOC'], query_stats=self.query_stats,
+            initial_data=())
+        # Movies and their ratings are partitioned across the remaining shards, each shard
+        # is created with the initial items whose titles hash to it
+        self.shards = [
+            SQLADAO(app, db_loc=app.config['SHARD_LOC'].format(index),
+                    query_stats=self.query_stats,
+                    initial_data=[item for item in INITIAL_DB_DATA
+                                  if self.route_title(item['title']) == index])
+            for index in range(self.shard_count)]
+
+    # Changes whenever any shard is written to
+    @property
+    def data_version(self):
+        """ Data version across all shards """
+        return sum(shard.data_version for shard in self.shards)
+
+    # Movie ids encode their shard, global id = (local id - 1) * shard count + shard + 1
+    def to_global(self, index, movie):
+        """ Replace a shard local movie id with its global id """
+        if movie:
+            movie['id'] = (movie['id'] - 1) * self.shard_count + index + 1
+        return movie
+
+    def route_id(self, id_):
+        """ Shard index and local id for a global movie id """
+        return (int(id_) - 1) % self.shard_count, (int(id_) - 1) // self.shard_count + 1
+
+    def route_title(self, title):
+        """ Shard index for a movie title, lower cased as titles are matched with like """
+        return zlib.crc32(title.lower().encode('utf-8')) % self.shard_count
+
+    # Query every shard and k-way merge the already sorted results
+    def merge_shards(self, method, key, **kwargs):
+        """ Merge sorted per shard results of method, keeping the first kwargs['limit'] """
+        results = [
+            [self.to_global(index, movie) for movie in getattr(shard, method)(**kwargs)]
+            for index, shard in enumerate(self.shards)]
+        return list(itertools.islice(heapq.merge(*results, key=key), kwargs['limit']))
+
+    def get_all_movies(self, **kwargs):
+        """ Get all movies, newest first across all shards """
+        return self.merge_shards(
+            'get_all_movies', key=lambda movie: -movie['id'], **kwargs)
+
+    def get_movie_by_id(self, **kwargs):
+        """ Get movie by id from its shard """
+        index, local_id = self.route_id(kwargs['id_'])
+        return self.to_global(index, self.shards[index].get_movie_by_id(
+            id_=local_id, fields=kwargs.get('fields')))
+
+    def get_movies_by_ids(self, **kwargs):
+        """ Get many movies by id, one IN query per shard holding any of them """
+        by_shard = {}
+        for id_ in kwargs['ids']:
+            index, local_id = self.route_id(id_)
+            by_shard.setdefault(index, []).append(local_id)
+        return [self.to_global(index, movie)
+                for index, local_ids in by_shard.items()
+                for movie in self.shards[index].get_movies_by_ids(
+                    ids=local_ids, fields=kwargs.get('fields'))]
+
+    def get_movie_by_title(self, **kwargs):
+        """ Get movie by title from its shard """
+        index = self.route_title(kwargs['title'])
+        return self.to_global(index, self.shards[index].get_movie_by_title(**kwargs))
+
+    def add_movie(self, **kwargs):
+        """ Add movie to the shard its title hashes to """
+        index = self.route_title(kwargs['title'])
+        return self.to_global(index, self.shards[index].add_movie(**kwargs))
+
+    def update_movie(self, **kwargs):
+        """ Update Movie in its shard """
+        index, local_id = self.route_id(kwargs['id_'])
+        self.shards[index].update_movie(id_=local_id, rating=kwargs['rating'])
+
+    def get_user(self, **kwargs):
+        """ Add user to the shared users shard """
+        return self.users.get_user(**kwargs)
+
+    def add_rating(self, **kwargs):
+        """ Add Rating to the movie's shard """
+        index, local_id = self.route_id(kwargs['movie_id'])
+        return self.shards[index].add_rating(
+            rating=kwargs['rating'], user_id=kwargs['user_id'], movie_id=local_id)
+
+    def get_movie_ratings(self, **kwargs):
+        """ Get a movie's ratings from its shard """
+        index, local_id = self.route_id(kwargs['movie_id'])
+        return self.shards[index].get_movie_ratings(movie_id=local_id)
+
+    def get_user_rating(self, **kwargs):
+        """ Get a user's rating of a movie from the movie's shard """
+        index, local_id = self.route_id(kwargs['movie_id'])
+        return self.shards[index].get_user_rating(user_id=kwargs['user_id'], movie_id=local_id)
+
+    def apply_rating_writes(self, **kwargs):
+        """ Apply queued rating writes, one transaction per shard """
+        by_shard = {}
+        for write in kwargs['writes']:
+            by_shard.setdefault(self.route_title(write['title']), []).append(write)
+        applied, failed = 0, 0
+        for index, writes in by_shard.items():
+            shard_applied, shard_failed = self.shards[index].apply_rating_writes(writes=writes)
+            applied += shard_applied
+            failed += shard_failed
+        return applied, failed
+
+    def get_rating_distribution(self, **kwargs):
+        """ Get a movie's rating distribution from its shard """
+        index, local_id = self.route_id(kwargs['movie_id'])
+        return self.shards[index].get_rating_distribution(movie_id=local_id)
+
+    def delete_user(self, **kwargs):
+        """ Delete User and their ratings from every shard """
+        for shard in self.shards:
+            shard.delete_user(**kwargs)
+        self.users.delete_user(**kwargs)
+
+    def delete_movie(self, **kwargs):
+        """ Delete Movie from its shard """
+        if 'id_' in kwargs:
+            index, local_id = self.route_id(kwargs['id_'])
+            self.shards[index].delete_movie(id_=local_id)
+        else:
+            self.shards[self.route_title(kwargs['title'])].delete_movie(title=kwargs['title'])
+
 
 # Convert result set to json format
-def convert_to_json(result_set, table):
-    """ Convert result set to json objects """
+def convert_to_json(result_set, table, columns=None):
+    """ Convert result set to json objects, optionally only the given columns """
     # pylint: disable=protected-access
     json_list = []
     # For each result
@@ -299,7 +625,7 @@ def convert_to_json(result_set, table):
         local_hash = {}
 
         # Iterate over Movie model column names
-        for column in table.__table__.columns._data.keys():
+        for column in columns or table.__table__.columns._data.keys():
             # Add result from object to hash
             local_hash[column] = getattr(result, column)
 
@@ -308,6 +634,18 @@ def convert_to_json(result_set, table):
     return json_list
 
 
+# Distribution bucket of a rating
+def rating_bucket(rating):
+    """ Nearest whole star to rating, within RATING_BUCKETS """
+    return min(RATING_BUCKETS[-1], max(RATING_BUCKETS[0], int(float(rating) + 0.5)))
+
+
+# Distribution column of a bucket
+def bucket_column(bucket):
+    """ RatingDistribution column name holding bucket's count """
+    return 'rating_{}'.format(bucket)
+
+
 # Custom exception extends ValueError
 class DAONotImplemented(ValueError):
     """ Custom exception extends ValueError """
@@ -0,0 +1,45 @@
+""" Non-blocking logging setup for the Flask ratings app """
+
+import queue
+import atexit
+import logging
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+from app.constants import SLOW_QUERY_LOGGER
+
+
+# Apply per logger levels from config
+def set_log_levels(app):
+    """ Set app logger and per module logger levels from config """
+    app.logger.setLevel(app.config['LOG_LEVEL'])
+    for name, level in app.config['LOG_LEVELS'].items():
+        logging.getLogger(name).setLevel(level)
+
+
+# Send a logger's records to a file from a background thread
+def queue_to_file(logger, filename, config):
+    """ Attach a queue handler to logger, drained to filename by a listener thread """
+    # Rotating file handler only ever runs on the listener thread
+    file_handler = RotatingFileHandler(
+        filename, maxBytes=config['LOG_MAX_BYTES'], backupCount=config['LOG_BACKUP_COUNT'])
+    file_handler.setFormatter(logging.Formatter(config['LOG_FORMAT']))
+
+    # Request threads only put records on the queue
+    log_queue = queue.Queue(-1)
+    logger.addHandler(QueueHandler(log_queue))
+    listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+    # Write out queued records on shutdown
+    atexit.register(listener.stop)
+    return listener
+
+
+# Configure logging for a running server
+def configure_logging(app):
+    """ Set levels and queue app and slow query logs to their files """
+    set_log_levels(app)
+    return [
+        queue_to_file(app.logger, app.config['LOG'], app.config),
+        # Slow query log, statements over SLOW_QUERY_THRESHOLD with their parameters
+        queue_to_file(logging.getLogger(SLOW_QUERY_LOGGER), app.config['SLOW_QUERY_LOG'],
+                      app.config),
+    ]
@@ -57,3 +57,27 @@ class Ratings(BASE):
     movie_id = Column(Integer)
     # Movie rating in databse, decorator
     rating = Column(StringFloat)
+
+
+class RatingDistribution(BASE):
+    """ Per movie rating histogram Object for ORM """
+    # Database table name
+    __tablename__ = 'rating_distributions'
+
+    # Movie id in database, integer and set to primary key
+    movie_id = Column(Integer, primary_key=True)
+    # Number of ratings in each bucket, a rating counts towards its nearest whole star
+    rating_1 = Column(Integer, default=0, nullable=False)
+    rating_2 = Column(Integer, default=0, nullable=False)
+    rating_3 = Column(Integer, default=0, nullable=False)
+    rating_4 = Column(Integer, default=0, nullable=False)
+    rating_5 = Column(Integer, default=0, nullable=False)
+
+
+class SchemaVersion(BASE):
+    """ Schema version Object for ORM """
+    # Database table name
+    __tablename__ = 'schema_version'
+
+    # Schema version applied to the database, integer and set to primary key
+    version = Column(Integer, primary_key=True)
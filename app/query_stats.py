@@ -0,0 +1,77 @@
+""" SQL query instrumentation for SQLAlchemy engines """
+
+import time
+import logging
+import threading
+from sqlalchemy import event
+from app.constants import SLOW_QUERY_LOGGER, SLOW_QUERY, TOO_MANY_QUERIES, \
+    REQUEST_QUERY_SUMMARY
+
+
+class QueryStats:
+    """ Count statements and measure execution time per request """
+
+    def __init__(self, config, logger):
+        # Get logger from application
+        self.logger = logger
+        # Logger used for statements over the slow query threshold
+        self.slow_logger = logging.getLogger(SLOW_QUERY_LOGGER)
+        # Seconds a statement may take before being logged as slow
+        self.slow_threshold = config.get('SLOW_QUERY_THRESHOLD')
+        # Maximum statements a single request may issue, None disables the check
+        self.max_queries = config.get('MAX_QUERIES_PER_REQUEST')
+        # Either 'warn' or 'raise' when max_queries is exceeded
+        self.max_queries_action = config.get('MAX_QUERIES_ACTION', 'warn')
+        # Counters are kept per thread as flask serves each request on its own thread
+        self.local = threading.local()
+
+    # Attach listeners to an engine
+    def instrument(self, engine):
+        """ Register cursor execute hooks on engine """
+        event.listen(engine, 'before_cursor_execute', self.before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', self.after_cursor_execute)
+
+    # pylint: disable=too-many-arguments,unused-argument
+    def before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        """ Record statement start time on the connection """
+        conn.info.setdefault('query_start_time', []).append(time.time())
+
+    # pylint: disable=too-many-arguments,unused-argument
+    def after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        """ Count statement and log it if it was slow """
+        elapsed = time.time() - conn.info['query_start_time'].pop()
+        # Update per request counters
+        self.local.count = getattr(self.local, 'count', 0) + 1
+        self.local.elapsed = getattr(self.local, 'elapsed', 0.0) + elapsed
+        # Log statement with its parameters if it was over the threshold
+        if self.slow_threshold is not None and elapsed >= self.slow_threshold:
+            self.slow_logger.warning(SLOW_QUERY, elapsed * 1000, statement, parameters)
+
+    # Reset counters at the start of a request
+    def start_request(self):
+        """ Reset per request counters """
+        self.local.count = 0
+        self.local.elapsed = 0.0
+
+    # Check counters at the end of a request
+    def end_request(self, path):
+        """ Log per request counters and enforce the query limit """
+        count = getattr(self.local, 'count', 0)
+        elapsed = getattr(self.local, 'elapsed', 0.0)
+        self.logger.debug(REQUEST_QUERY_SUMMARY, path, count, elapsed * 1000)
+
+        # Check number of statements is within the permitted limit
+        if self.max_queries is not None and count > self.max_queries:
+            if self.max_queries_action == 'raise':
+                raise TooManyQueries(TOO_MANY_QUERIES % (path, count, self.max_queries))
+            self.logger.warning(TOO_MANY_QUERIES, path, count, self.max_queries)
+        return count, elapsed
+
+
+# Custom exception extends RuntimeError
+class TooManyQueries(RuntimeError):
+    """ Raised when a request issues more statements than permitted """
+    def __init__(self, message):
+        self.message = message
+        # Calling RuntimeError init method
+        super().__init__(message)
@@ -0,0 +1,140 @@
+""" Rebuild per movie rating aggregates from the Ratings table offline """
+
+import time
+import logging
+import argparse
+import numpy as np
+from sqlalchemy import create_engine, select, bindparam, cast, func, Float
+from app.config import Config
+from app.models.models import Movie, Ratings, RatingDistribution
+from app.constants import RATING_BUCKETS, REBUILD_PROGRESS, REBUILD_COMPLETE
+
+
+class Aggregates:
+    """ Per movie rating counts, sums and bucket counts, indexed by movie id """
+
+    def __init__(self, size=0):
+        self.counts = np.zeros(size, dtype=np.int64)
+        self.sums = np.zeros(size, dtype=np.float64)
+        self.distributions = np.zeros((size, len(RATING_BUCKETS)), dtype=np.int64)
+
+    # Make room for movie ids up to size - 1
+    def grow(self, size):
+        """ Extend the arrays with zeros to hold size movie ids """
+        extra = size - len(self.counts)
+        if extra > 0:
+            self.counts = np.concatenate([self.counts, np.zeros(extra, dtype=np.int64)])
+            self.sums = np.concatenate([self.sums, np.zeros(extra, dtype=np.float64)])
+            self.distributions = np.concatenate([
+                self.distributions, np.zeros((extra, len(RATING_BUCKETS)), dtype=np.int64)])
+
+    # Fold one chunk of ratings in
+    def add(self, movie_ids, ratings):
+        """ Add a chunk of parallel movie id and rating arrays to the aggregates """
+        self.grow(int(movie_ids.max()) + 1)
+        size = len(self.counts)
+        # Grouped sums by movie id, one pass over the chunk each
+        self.counts += np.bincount(movie_ids, minlength=size)
+        self.sums += np.bincount(movie_ids, weights=ratings, minlength=size)
+        # Nearest whole star as dao.rating_bucket rounds it, then grouped by movie and bucket
+        buckets = np.clip(np.floor(ratings + 0.5).astype(np.int64),
+                          RATING_BUCKETS[0], RATING_BUCKETS[-1]) - RATING_BUCKETS[0]
+        self.distributions += np.bincount(
+            movie_ids * len(RATING_BUCKETS) + buckets,
+            minlength=size * len(RATING_BUCKETS)).reshape(size, len(RATING_BUCKETS))
+
+    # Mean rating of every movie with ratings
+    def means(self):
+        """ Mean rating per movie id, nan where a movie has no ratings """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self.sums / self.counts
+
+
+# Stream ratings into aggregates
+def read_ratings(conn, chunk_size, logger, name):
+    """ Aggregates over every rating, holding at most chunk_size ratings in memory """
+    # Start sized for every movie, ratings of deleted movies grow the arrays as needed
+    aggregates = Aggregates((conn.execute(select([func.max(Movie.id)])).scalar() or 0) + 1)
+    # Let sqlite convert the stored strings, StringFloat would convert row by row
+    result = conn.execute(select([Ratings.movie_id, cast(Ratings.rating, Float)]))
+    start = time.time()
+    read = 0
+    while True:
+        rows = result.fetchmany(chunk_size)
+        if not rows:
+            break
+        movie_ids, ratings = zip(*rows)
+        aggregates.add(np.array(movie_ids, dtype=np.int64), np.array(ratings, dtype=np.float64))
+        read += len(rows)
+        logger.info(REBUILD_PROGRESS, name, read, read / max(time.time() - start, 1e-9))
+    return aggregates, read
+
+
+# Write aggregates back
+def write_aggregates(engine, aggregates, chunk_size):
+    """ Replace movie ratings and distributions, one transaction per chunk_size movie ids """
+    means = aggregates.means()
+    update_rating = Movie.__table__.update().where(
+        Movie.id == bindparam('movie_id')).values(rating=bindparam('mean'))
+    written = 0
+    size = len(aggregates.counts)
+    for low in range(0, size, chunk_size):
+        high = min(low + chunk_size, size)
+        # Movies in this range with at least one rating
+        rated = np.flatnonzero(aggregates.counts[low:high]) + low
+        with engine.begin() as conn:
+            # Distributions are replaced outright so drifted rows are corrected
+            conn.execute(RatingDistribution.__table__.delete().where(
+                RatingDistribution.movie_id.between(low, high - 1)))
+            if len(rated):
+                columns = ['rating_{}'.format(bucket) for bucket in RATING_BUCKETS]
+                conn.execute(RatingDistribution.__table__.insert(), [
+                    dict(zip(columns, distribution), movie_id=movie_id)
+                    for movie_id, distribution in zip(
+                        rated.tolist(), aggregates.distributions[rated].tolist())])
+                # Movies without ratings keep the rating they were added with
+                conn.execute(update_rating, [
+                    {'movie_id': movie_id, 'mean': mean}
+                    for movie_id, mean in zip(rated.tolist(), means[rated].tolist())])
+        written += len(rated)
+    # Distributions of movie ids past the last one seen have no ratings left
+    with engine.begin() as conn:
+        conn.execute(RatingDistribution.__table__.delete().where(
+            RatingDistribution.movie_id >= size))
+    return written
+
+
+# Rebuild one database
+def rebuild(db_loc, chunk_size, logger):
+    """ Recompute and write back per movie aggregates of the database at db_loc """
+    start = time.time()
+    engine = create_engine(db_loc)
+    # Databases that have not been started since distributions were added lack the table
+    RatingDistribution.__table__.create(engine, checkfirst=True)
+    with engine.connect() as conn:
+        aggregates, read = read_ratings(conn, chunk_size, logger, db_loc)
+    written = write_aggregates(engine, aggregates, chunk_size)
+    logger.info(REBUILD_COMPLETE, db_loc, read, int(np.count_nonzero(aggregates.counts)),
+                written, time.time() - start)
+    return aggregates
+
+
+def main():
+    """ Rebuild movie ratings and rating distributions from the Ratings table """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    # Every movie shard holds its own ratings, the users shard has none
+    default_dbs = [Config.SHARD_LOC.format(index) for index in range(Config.SHARD_COUNT)] \
+        if Config.DAO_TYPE == 'ShardedSQLADAO' else [Config.DB_LOC]
+    parser.add_argument('--db', nargs='+', default=default_dbs,
+                        help='databases to rebuild, defaults to the configured DAO\'s')
+    parser.add_argument('--chunk-size', type=int, default=Config.REBUILD_CHUNK_SIZE,
+                        help='ratings read at once and movies written per transaction')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(message)s')
+    for db_loc in args.db:
+        rebuild(db_loc, args.chunk_size, logging.getLogger(__name__))
+
+
+if __name__ == '__main__':
+    main()
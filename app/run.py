@@ -1,18 +1,40 @@
 """ Flask Ratings application """
 
-import logging
-from logging.handlers import RotatingFileHandler
 from flask import Flask, request
 from app.app_obj import AppObject
 from app.config import Config
+from app.log import set_log_levels, configure_logging
 
 # Initialize flask application
 app = Flask(__name__)
 # Load application configuration file
 app.config.from_object(Config)
+# Set app and per module log levels from configuration file
+set_log_levels(app)
 # Load app object to do the work
 app_obj = AppObject(app)
 
+# Reset query counters and apply admission control before each request
+@app.before_request
+def before_request():
+    """ Before request hook """
+    return app_obj.before_request(request)
+
+
+# Check query counters after each request
+@app.after_request
+def after_request(response):
+    """ After request hook """
+    return app_obj.after_request(request, response)
+
+
+# Release admission control slots once each request is done
+@app.teardown_request
+def teardown_request(exception):
+    """ Teardown request hook """
+    app_obj.teardown_request()
+
+
 # Route to access movie list
 @app.route('/movies', methods=['GET'])
 def list_movies():
@@ -34,6 +56,13 @@ def update_movie():
     return app_obj.update_movie(request)
 
 
+# Route to get many movies by id, for lists too long for ?ids=
+@app.route('/movies/batch', methods=['POST'])
+def batch_movies():
+    """ Get movies by ids """
+    return app_obj.batch_movies(request)
+
+
 # Route to get movie by id
 @app.route('/movies/<int:movie_id>', methods=['GET'])
 def get_movie_by_id(movie_id):
@@ -41,17 +70,29 @@ def get_movie_by_id(movie_id):
     return app_obj.get_movie_by_id(request, movie_id)
 
 
+
+# Route to get movie rating distribution
+@app.route('/movies/<int:movie_id>/distribution', methods=['GET'])
+def get_rating_distribution(movie_id):
+    """ Get movie rating distribution """
+    return app_obj.get_rating_distribution(request, movie_id)
+
+
+
+# Route to get similar movies
+@app.route('/movies/<int:movie_id>/similar', methods=['GET'])
+def get_similar_movies(movie_id):
+    """ Get similar movies """
+    return app_obj.get_similar_movies(request, movie_id)
+
+
 if __name__ == '__main__':
-    # Rotating file handler to output to files up to 1MB before rollover
-    handler = RotatingFileHandler(app.config['LOG'], maxBytes=10000, backupCount=1)
-    # Initialize formatter
-    formatter = logging.Formatter(app.config['LOG_FORMAT'])
-    # Set handler formatter
-    handler.setFormatter(formatter)
-    # Setting log level based on config file
-    handler.setLevel(app.config['LOG_LEVEL'])
-    # Add handler to app logger
-    app.logger.addHandler(handler)
+    # Log files are written by background listener threads so requests never block on I/O
+    configure_logging(app)
+
+    # Warm third party ratings cache without delaying readiness
+    if app.config['WARMUP_ON_STARTUP']:
+        app_obj.start_warmup()
 
     # Get app port from config
     port = app.config['FLASK_APP_PORT']
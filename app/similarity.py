@@ -0,0 +1,152 @@
+""" Item-item similar movies index, built offline and memory-mapped at serve time """
+
+import os
+import time
+import logging
+import argparse
+import threading
+import numpy as np
+from sqlalchemy import create_engine, select, cast, Float
+from app.config import Config
+from app.models.models import Ratings
+from app.constants import SIMILARITY_READ, SIMILARITY_PROGRESS, SIMILARITY_COMPLETE
+
+
+# One fixed size row per movie id, neighbors in descending score order, padded with id 0
+def index_dtype(top_k):
+    """ Record type of an index row holding top_k neighbors """
+    return np.dtype([('ids', '<i4', (top_k,)), ('scores', '<f4', (top_k,))])
+
+
+class SimilarityIndex:
+    """ Read only view of an index file, reloaded when the file is rebuilt """
+
+    def __init__(self, path):
+        self.path = path
+        # Memory-mapped rows and the modification time they were mapped at
+        self.rows = None
+        self.mtime = None
+        self.lock = threading.Lock()
+
+    # Map the file, or remap it after a rebuild replaced it
+    def load(self):
+        """ Current rows, None if the index has not been built """
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return None
+        with self.lock:
+            if mtime != self.mtime:
+                self.rows = np.load(self.path, mmap_mode='r')
+                self.mtime = mtime
+            return self.rows
+
+    def neighbors(self, movie_id, limit):
+        """ Up to limit (movie id, score) pairs most similar to movie_id, None without an index """
+        rows = self.load()
+        if rows is None:
+            return None
+        # Movies added since the build have no neighbors yet
+        if movie_id < 0 or movie_id >= len(rows):
+            return []
+        row = rows[movie_id]
+        return [(int(id_), float(score))
+                for id_, score in zip(row['ids'][:limit], row['scores'][:limit]) if id_]
+
+
+# Read the user x movie ratings matrix
+def read_ratings(dbs, chunk_size, logger):
+    """ Sparse users x movies matrix of ratings from (db location, shard index) pairs """
+    # Imported here as only building needs scipy, servers just map the index
+    from scipy import sparse
+    users, movies, ratings = [], [], []
+    for db_loc, shard in dbs:
+        engine = create_engine(db_loc)
+        with engine.connect() as conn:
+            # Let sqlite convert the stored strings, StringFloat would convert row by row
+            result = conn.execute(
+                select([Ratings.user_id, Ratings.movie_id, cast(Ratings.rating, Float)]))
+            while True:
+                rows = result.fetchmany(chunk_size)
+                if not rows:
+                    break
+                user_ids, movie_ids, values = zip(*rows)
+                movie_ids = np.array(movie_ids, dtype=np.int32)
+                # Shard local ids to global ids as ShardedSQLADAO numbers them
+                if shard is not None:
+                    movie_ids = (movie_ids - 1) * Config.SHARD_COUNT + shard + 1
+                users.append(np.array(user_ids, dtype=np.int32))
+                movies.append(movie_ids)
+                ratings.append(np.array(values, dtype=np.float32))
+        logger.info(SIMILARITY_READ, db_loc, sum(len(chunk) for chunk in ratings))
+
+    if not ratings:
+        return sparse.csr_matrix((1, 1), dtype=np.float32)
+    users, movies, ratings = (np.concatenate(arrays) for arrays in (users, movies, ratings))
+    return sparse.csr_matrix(
+        (ratings, (users, movies)), shape=(int(users.max()) + 1, int(movies.max()) + 1))
+
+
+# Build the index
+def build(matrix, path, top_k, block_size, logger):
+    """ Write the top_k cosine neighbors of every movie in matrix to path """
+    from scipy import sparse
+    start = time.time()
+    # Scale every movie's column to unit length so dot products are cosine similarities
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=0)).ravel())
+    scale = np.divide(1.0, norms, out=np.zeros_like(norms), where=norms > 0)
+    normalized = (matrix @ sparse.diags(scale.astype(np.float32))).tocsc()
+    by_movie = normalized.T.tocsr()
+
+    movie_count = matrix.shape[1]
+    # Written to a temporary file and swapped in, so servers never map a partial index
+    partial = '{}.partial.npy'.format(path)
+    rows = np.lib.format.open_memmap(partial, mode='w+', dtype=index_dtype(top_k),
+                                     shape=(movie_count,))
+    for low in range(0, movie_count, block_size):
+        high = min(low + block_size, movie_count)
+        # Similarities of this block of movies to every movie, only co-rated pairs are stored
+        block = (by_movie[low:high] @ normalized).tocsr()
+        block.setdiag(0, k=low)
+        block.eliminate_zeros()
+        for offset in range(high - low):
+            ids = block.indices[block.indptr[offset]:block.indptr[offset + 1]]
+            scores = block.data[block.indptr[offset]:block.indptr[offset + 1]]
+            if len(ids) > top_k:
+                keep = np.argpartition(-scores, top_k)[:top_k]
+                ids, scores = ids[keep], scores[keep]
+            order = np.argsort(-scores, kind='stable')
+            rows['ids'][low + offset, :len(ids)] = ids[order]
+            rows['scores'][low + offset, :len(ids)] = scores[order]
+        logger.info(SIMILARITY_PROGRESS, high, movie_count)
+    rows.flush()
+    del rows
+    os.replace(partial, path)
+    logger.info(SIMILARITY_COMPLETE, movie_count, matrix.nnz, path, time.time() - start)
+
+
+def main():
+    """ Build the similar movies index from the Ratings table """
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--output', default=Config.SIMILARITY_INDEX, help='index file to write')
+    parser.add_argument('--top-k', type=int, default=Config.SIMILARITY_TOP_K,
+                        help='neighbors stored per movie')
+    parser.add_argument('--block-size', type=int, default=Config.SIMILARITY_BLOCK_SIZE,
+                        help='movies whose similarities are computed at once')
+    parser.add_argument('--chunk-size', type=int, default=Config.REBUILD_CHUNK_SIZE,
+                        help='ratings read at once')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(message)s')
+    logger = logging.getLogger(__name__)
+    # Every movie shard holds its own ratings, the users shard has none
+    if Config.DAO_TYPE == 'ShardedSQLADAO':
+        dbs = [(Config.SHARD_LOC.format(index), index) for index in range(Config.SHARD_COUNT)]
+    else:
+        dbs = [(Config.DB_LOC, None)]
+    build(read_ratings(dbs, args.chunk_size, logger), args.output, args.top_k,
+          args.block_size, logger)
+
+
+if __name__ == '__main__':
+    main()
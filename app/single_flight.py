@@ -0,0 +1,55 @@
+""" Coalescing of concurrent identical calls """
+
+import threading
+
+
+class Call:
+    """ A call in flight and, once done, its result or exception """
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """ Runs one call per key at a time, concurrent callers with the same key share its result """
+
+    def __init__(self):
+        # Key: Call in flight
+        self.calls = {}
+        self.lock = threading.Lock()
+        # Counters for monitoring, coalesced calls waited on another caller's call
+        self.stats = {'calls': 0, 'coalesced': 0}
+
+    def do(self, key, function):
+        """ Result of function(), or of the call already in flight for key """
+        with self.lock:
+            call = self.calls.get(key)
+            if call is None:
+                # First caller runs the call
+                call = self.calls[key] = Call()
+                leader = True
+                self.stats['calls'] += 1
+            else:
+                leader = False
+                self.stats['coalesced'] += 1
+
+        if not leader:
+            # Wait for the first caller, failures are shared too
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = function()
+            return call.result
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            # Later callers start a fresh call, so results are never served stale from here
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
@@ -2,13 +2,24 @@
 """ Test suite for Flask ratings app """
 
 import unittest
+import os
 import json
+import logging
+import tempfile
+import threading
 import requests
+import numpy as np
+from scipy import sparse
 from flask import Flask
 from app.config import Config
 from app.constants import MOVIE_LIST_MIN, MOVIE_LIST_MAX, OMDB_RATINGS, MOVIE_ALREADY_EXISTS, \
     MOVIE_DOES_NOT_EXIST
 from app.dao import SQLADAO
+from app.query_stats import TooManyQueries
+from app.write_queue import WriteBehindQueue
+from app.rebuild import Aggregates
+from app.similarity import SimilarityIndex, build
+from app.single_flight import SingleFlight
 
 # Headers to be sent with post/put
 HEADERS = {'content-type': 'application/json'}
@@ -259,6 +270,135 @@ class FlaskAppTestSuite(unittest.TestCase):
         # Carry out assertion
         self.assertTrue(set(required_ratings).issubset(set(remote_ratings)))
 
+    def test_get_movies_by_ids(self):
+        """ Test batch get movies by ids, in order with not found entries """
+        # Add required movies first
+        add_movies(MOVIES_TO_ADD[:2], self.db_dao)
+        # Query for movies
+        first = self.db_dao.get_movie_by_title(title=MOVIES_TO_ADD[0]['title'])
+        second = self.db_dao.get_movie_by_title(title=MOVIES_TO_ADD[1]['title'])
+        # Delete first movie so it is not found
+        delete_movies([MOVIES_TO_ADD[0]], self.db_dao)
+        # Query for movies by ids
+        response_obj = requests.get(self.url + '?ids={},{}'.format(second['id'], first['id']))
+        # Get reponse objects movies to variable
+        found_movies = response_obj.json()['Movies']
+        # Delete movie above
+        delete_movies([MOVIES_TO_ADD[1]], self.db_dao)
+        # Carry out assertion
+        self.assertTrue(found_movies[0]['title'] == second['title'] and
+                        found_movies[1]['id'] == first['id'] and 'errors' in found_movies[1])
+
+    def test_query_stats_count(self):
+        """ Test statements issued through the dao are counted """
+        # Connect first so schema bootstrap statements are not counted
+        self.db_dao.connect()
+        # Reset counters
+        self.db_dao.query_stats.start_request()
+        # Issue a single select
+        self.db_dao.get_movie_by_title(title=OMDB_MOVIE['title'])
+        # Get counters
+        count, _ = self.db_dao.query_stats.end_request('/test')
+        # Carry out assertion
+        self.assertTrue(count == 1)
+
+    def test_query_stats_max_queries_raise(self):
+        """ Test exceeding the query limit raises when configured to """
+        # Lower limit and raise when exceeded
+        self.db_dao.query_stats.max_queries = 1
+        self.db_dao.query_stats.max_queries_action = 'raise'
+        # Reset counters
+        self.db_dao.query_stats.start_request()
+        # Issue two selects
+        self.db_dao.get_movie_by_title(title=OMDB_MOVIE['title'])
+        self.db_dao.get_movie_by_title(title=OMDB_MOVIE['title'])
+        # Carry out assertion
+        with self.assertRaises(TooManyQueries):
+            self.db_dao.query_stats.end_request('/test')
+
+    def test_write_behind_queue(self):
+        """ Test queued rating writes are applied by the writer thread """
+        # Get user to rate as
+        user = self.db_dao.get_user(clientip=self.clientip)
+        # Queue a rating write and wait for it to be applied
+        write_queue = WriteBehindQueue(self.db_dao, self.app.config, self.app.logger)
+        write_queue.put({'method': 'POST', 'title': MOVIES_TO_ADD[0]['title'],
+                         'rating': 4, 'user_id': user['id']})
+        write_queue.close()
+        # Query for movie
+        movie = self.db_dao.get_movie_by_title(title=MOVIES_TO_ADD[0]['title'])
+        # Delete created movie
+        delete_movies([MOVIES_TO_ADD[0]], self.db_dao)
+        # Carry out assertion
+        self.assertTrue(movie and write_queue.stats['applied'] == 1)
+
+    def test_rating_distribution(self):
+        """ Test a changed rating moves out of its old distribution bucket """
+        # Add required movie first
+        add_movies([MOVIES_TO_ADD[0]], self.db_dao)
+        # Query for movie
+        movie = self.db_dao.get_movie_by_title(title=MOVIES_TO_ADD[0]['title'])
+        # Get user to rate as
+        user = self.db_dao.get_user(clientip=self.clientip)
+        # Rate the movie then change the rating
+        self.db_dao.add_rating(rating=4, user_id=user['id'], movie_id=movie['id'])
+        self.db_dao.add_rating(rating=2, user_id=user['id'], movie_id=movie['id'])
+        # Query for distribution
+        distribution = self.db_dao.get_rating_distribution(movie_id=movie['id'])
+        # Delete movie above
+        delete_movies([MOVIES_TO_ADD[0]], self.db_dao)
+        # Carry out assertion
+        self.assertTrue(distribution == {'1': 0, '2': 1, '3': 0, '4': 0, '5': 0})
+
+    def test_rebuild_aggregates(self):
+        """ Test chunked aggregates match the ratings they were built from """
+        # Ratings of movies 1 and 3 split across two chunks
+        aggregates = Aggregates()
+        aggregates.add(np.array([1, 3, 1]), np.array([4.0, 2.4, 5.0]))
+        aggregates.add(np.array([3]), np.array([1.0]))
+        # Carry out assertion
+        self.assertTrue(aggregates.counts.tolist() == [0, 2, 0, 2] and
+                        aggregates.means()[1] == 4.5 and
+                        aggregates.distributions[3].tolist() == [1, 1, 0, 0, 0])
+
+    def test_similarity_index(self):
+        """ Test similar movies are the co-rated ones, most similar first """
+        # Two users rating movies 1 and 2 alike, one of them also rating movie 3
+        matrix = sparse.csr_matrix(np.array([[0, 4, 5, 0], [0, 3, 4, 1]], dtype=np.float32))
+        # Build index and look up neighbors of movie 1
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'similar.npy')
+            build(matrix, path, 5, 2, logging.getLogger(__name__))
+            neighbors = SimilarityIndex(path).neighbors(1, 5)
+        # Carry out assertion
+        self.assertTrue([id_ for id_, _ in neighbors] == [2, 3] and
+                        neighbors[0][1] > neighbors[1][1])
+
+    def test_single_flight(self):
+        """ Test concurrent calls with the same key share one call """
+        flight = SingleFlight()
+        # Held until every caller has joined the call in flight
+        release = threading.Event()
+        results = []
+
+        def call():
+            """ Slow call counting how often it really runs """
+            release.wait()
+            return len(results)
+
+        threads = [threading.Thread(target=lambda: results.append(flight.do('key', call)))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        # Wait for the other callers to be coalesced before letting the call finish
+        while flight.stats['coalesced'] < 4:
+            release.wait(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+        # Carry out assertion
+        self.assertTrue(results == [0] * 5 and flight.stats == {'calls': 1, 'coalesced': 4})
+
 def delete_user_and_ratings(dao, clientip):
     """ Delete user and their ratings """
     # Get user first
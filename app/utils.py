@@ -1,9 +1,12 @@
 """ Flask Ratings utilities """
 
 import sys
-from requests import get
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from jsonschema import validate, ValidationError, SchemaError
-from app.constants import OMDB_RATINGS, OMDB_BASE_URL, POST_PUT_SCHEMA, JSON_ERROR_OBJECT
+from app.constants import OMDB_RATINGS, POST_PUT_SCHEMA, JSON_ERROR_OBJECT
+from app.cache import TTLCache
+from app.single_flight import SingleFlight
 from flask import jsonify
 
 class Utils:
@@ -14,17 +17,51 @@ class Utils:
         self.config = config
         # Get logger from application
         self.logger = logger
+        # HTTP session, created on first use
+        self.http_session = None
+        # Guards against concurrent first requests both creating a session
+        self.http_lock = threading.Lock()
+        # Thread pool for batched enrichment, created on first use
+        self.executor = None
+        # Third party ratings by lower cased title
+        self.ratings_cache = TTLCache(config['OMDB_CACHE_SIZE'], config['OMDB_CACHE_TTL'])
+        # Concurrent cache misses for the same title share one OMDB request
+        self.omdb_flight = SingleFlight()
+
+    def get_http_session(self):
+        """ HTTP session reused across requests for connection pooling """
+        if self.http_session is None:
+            with self.http_lock:
+                if self.http_session is None:
+                    # Imported here so requests is only loaded once enrichment is needed
+                    from requests import Session
+                    self.http_session = Session()
+        return self.http_session
 
     def get_third_party_ratings(self, movie_name):
+        """ Get ratings from 3rd party site, cached for OMDB_CACHE_TTL seconds """
+        cached = self.ratings_cache.get(movie_name.lower())
+        if cached is not None:
+            return cached
+
+        def fetch():
+            """ Fetch and cache ratings, run once per title however many threads miss """
+            local_hash = self.fetch_third_party_ratings(movie_name)
+            self.ratings_cache.set(movie_name.lower(), local_hash)
+            return local_hash
+        return self.omdb_flight.do(movie_name.lower(), fetch)
+
+    def fetch_third_party_ratings(self, movie_name):
         """ Get ratings from 3rd party site """
         omdb_ratings = OMDB_RATINGS
         # Omdb url to get remote 3rd part ratings
-        omdb_url = '{}/?t={}&apikey={}'.format(OMDB_BASE_URL, movie_name, self.config['API_KEY'])
+        omdb_url = '{}/?t={}&apikey={}'.format(
+            self.config['OMDB_BASE_URL'], movie_name, self.config['API_KEY'])
 
         # local hash to store results before returning
         local_hash = {}
         # Send request to OMDB
-        response = get(omdb_url)
+        response = self.get_http_session().get(omdb_url)
         # Extract json response
         json_data = response.json()
         # check results object has 'Ratings' before proceeding
@@ -41,12 +78,30 @@ class Utils:
         # Return local hash of ratings to update stored movies
         return local_hash
 
-    def validate_json(self, received_json):
+    def get_third_party_ratings_batch(self, movie_names):
+        """ Get ratings from 3rd party site for many movies, returns {movie name: ratings} """
+        # Each distinct title is only looked up once
+        names = list(dict.fromkeys(movie_names))
+        # Only titles that are not cached need a thread
+        missing = [name for name in names if name.lower() not in self.ratings_cache]
+        if len(missing) <= 1:
+            return {name: self.get_third_party_ratings(name) for name in names}
+        if self.executor is None:
+            with self.http_lock:
+                if self.executor is None:
+                    self.executor = ThreadPoolExecutor(
+                        max_workers=self.config['OMDB_BATCH_CONCURRENCY'])
+        # Look titles up concurrently, OMDB has no batch endpoint
+        ratings = dict(zip(missing, self.executor.map(self.get_third_party_ratings, missing)))
+        return {name: ratings[name] if name in ratings else self.get_third_party_ratings(name)
+                for name in names}
+
+    def validate_json(self, received_json, schema=POST_PUT_SCHEMA):
         """ Validate put/post json """
         error = None
         try:
             # Valide json matches our schema
-            validate(received_json, POST_PUT_SCHEMA)
+            validate(received_json, schema)
         # Catch jsonschema specific Exceptions
         except (ValidationError, SchemaError):
             # Split error object to return to client
@@ -0,0 +1,99 @@
+""" Third party ratings cache warm-up """
+
+import time
+import argparse
+import threading
+from app.constants import WARMUP_PROGRESS, WARMUP_COMPLETE, WARMUP_FAILED, \
+    WARMUP_PROGRESS_EVERY
+
+
+class CacheWarmer:
+    """ Walk the most recently added movies and warm their third party ratings """
+
+    def __init__(self, dao, warm, config, logger, is_warm=None):
+        # Movies are read through the dao
+        self.dao = dao
+        # Called with each movie to warm it
+        self.warm = warm
+        # Called with each movie, True if it does not need warming
+        self.is_warm = is_warm or (lambda movie: False)
+        # Get logger from application
+        self.logger = logger
+        # Most recently added movies to warm
+        self.limit = config['WARMUP_LIMIT']
+        # Seconds between warm calls, bounding the OMDB request rate
+        self.interval = 1.0 / config['WARMUP_RATE']
+        # Progress for monitoring
+        self.progress = {'total': 0, 'warmed': 0, 'skipped': 0, 'failed': 0, 'running': False}
+
+    # Run in the background so readiness is never delayed
+    def start(self):
+        """ Start warming on a daemon thread """
+        thread = threading.Thread(target=self.run, name='cache-warmup', daemon=True)
+        thread.start()
+        return thread
+
+    def run(self):
+        """ Warm every movie, at most one warm call per interval """
+        self.progress['running'] = True
+        start = time.time()
+        movies = self.dao.get_all_movies(limit=self.limit)
+        self.progress['total'] = len(movies)
+
+        for count, movie in enumerate(movies, 1):
+            if self.is_warm(movie):
+                self.progress['skipped'] += 1
+                continue
+            called = time.time()
+            try:
+                self.warm(movie)
+                self.progress['warmed'] += 1
+            except Exception:  # pylint: disable=broad-except
+                # A failed title is left for the first request to fetch
+                self.progress['failed'] += 1
+                self.logger.debug(WARMUP_FAILED, movie['title'], exc_info=True)
+            if count % WARMUP_PROGRESS_EVERY == 0:
+                self.logger.info(WARMUP_PROGRESS, count, len(movies))
+            # Sleep off the rest of the interval
+            time.sleep(max(0.0, self.interval - (time.time() - called)))
+
+        self.progress['running'] = False
+        self.logger.info(WARMUP_COMPLETE, self.progress['warmed'], self.progress['skipped'],
+                         self.progress['failed'], time.time() - start)
+        return self.progress
+
+
+def main():
+    """ Warm a running server's third party ratings cache """
+    # Imported here so the module can be used without building an app
+    import logging
+    from requests import Session
+    from flask import Flask
+    from app.config import Config
+    from app.dao import DAO
+
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--url', default='http://{}:{}'.format(
+        Config.FLASK_APP_HOST, Config.FLASK_APP_PORT), help='server to warm')
+    parser.add_argument('--limit', type=int, default=Config.WARMUP_LIMIT,
+                        help='most recently added movies to warm')
+    parser.add_argument('--rate', type=float, default=Config.WARMUP_RATE,
+                        help='maximum requests per second')
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.config.from_object(Config)
+    app.config['WARMUP_LIMIT'] = args.limit
+    app.config['WARMUP_RATE'] = args.rate
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(message)s')
+    session = Session()
+
+    def warm(movie):
+        """ Get the movie from the server, which caches its third party ratings """
+        session.get('{}/movies/{}'.format(args.url, movie['id'])).raise_for_status()
+
+    CacheWarmer(DAO.dao_factory(app), warm, app.config, logging.getLogger(__name__)).run()
+
+
+if __name__ == '__main__':
+    main()
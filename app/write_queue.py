@@ -0,0 +1,91 @@
+""" Write-behind queue for rating writes """
+
+import queue
+import atexit
+import threading
+from app.constants import WRITE_BATCH_APPLIED, WRITE_BATCH_FAILED, WRITE_QUEUE_FLUSHED
+
+# Put on the queue to stop the writer thread
+STOP = object()
+
+
+class WriteBehindQueue:
+    """ Bounded queue of rating writes drained by a single writer thread """
+
+    def __init__(self, dao, config, logger):
+        # Writes are applied through the dao
+        self.dao = dao
+        # Get logger from application
+        self.logger = logger
+        # Maximum writes applied in one transaction
+        self.batch_size = config['WRITE_BATCH_SIZE']
+        # Seconds a request waits for room in a full queue before being refused
+        self.put_timeout = config['WRITE_QUEUE_TIMEOUT']
+        # Bounded so a burst applies backpressure rather than growing memory
+        self.queue = queue.Queue(maxsize=config['WRITE_QUEUE_SIZE'])
+        # Counters for monitoring
+        self.stats = {'queued': 0, 'applied': 0, 'failed': 0, 'batches': 0, 'rejected': 0}
+        # Dedicated writer thread
+        self.writer = threading.Thread(target=self.drain, name='write-behind', daemon=True)
+        self.writer.start()
+        # Flush pending writes when the interpreter exits
+        atexit.register(self.close)
+
+    # Queue a rating write
+    def put(self, write):
+        """ Queue write, raise queue.Full if there is no room within put_timeout """
+        try:
+            self.queue.put(write, timeout=self.put_timeout)
+        except queue.Full:
+            self.stats['rejected'] += 1
+            raise
+        self.stats['queued'] += 1
+
+    # Writer thread main loop
+    def drain(self):
+        """ Apply queued writes in batches until stopped """
+        while True:
+            # Block for the first write, then take whatever else is waiting
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = STOP in batch
+            writes = [write for write in batch if write is not STOP]
+            if writes:
+                self.apply(writes)
+            for _ in batch:
+                self.queue.task_done()
+            if stop:
+                return
+
+    # Apply a batch of writes
+    def apply(self, writes):
+        """ Apply writes in a single transaction """
+        try:
+            applied, failed = self.dao.apply_rating_writes(writes=writes)
+        except Exception:  # pylint: disable=broad-except
+            # Never let the writer thread die, the writes are lost but logged
+            self.logger.exception(WRITE_BATCH_FAILED, len(writes))
+            applied, failed = 0, len(writes)
+        self.stats['applied'] += applied
+        self.stats['failed'] += failed
+        self.stats['batches'] += 1
+        self.logger.debug(WRITE_BATCH_APPLIED, applied, failed)
+
+    # Wait for queued writes to be applied
+    def flush(self):
+        """ Block until every queued write has been applied """
+        self.queue.join()
+
+    # Stop the writer thread
+    def close(self):
+        """ Apply pending writes and stop the writer thread """
+        if not self.writer.is_alive():
+            return
+        self.queue.put(STOP)
+        self.writer.join()
+        self.logger.info(WRITE_QUEUE_FLUSHED, self.stats['applied'])